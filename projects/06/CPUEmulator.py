@@ -0,0 +1,403 @@
+#!/bin/env python
+
+import sys
+import os
+import struct
+import time
+import zlib
+from array import array
+
+import HackAssembler
+
+RAM_SIZE = 1 << 15
+SCREEN = HackAssembler.BUILTIN_SYMBOLS["SCREEN"]
+KBD = HackAssembler.BUILTIN_SYMBOLS["KBD"]
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = 256
+# Bytes per screen row in a snapshot
+ROW_BYTES = SCREEN_WIDTH // 8
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+COMP_MASK = 0x7F << 6
+A_BIT = 1 << 12
+# 0;JMP
+HALT_JUMP = 0xEA87
+
+# What each computation does, as Python source with y standing for A (or M,
+# when the a bit is set). Keyed by the mnemonic of the assembler's
+# COMP_TABLE, in its A form.
+COMP_SOURCES = {
+    "0": "0",
+    "1": "1",
+    "-1": "0xFFFF",
+    "D": "d",
+    "A": "{y}",
+    "!D": "~d & 0xFFFF",
+    "!A": "~{y} & 0xFFFF",
+    "-D": "-d & 0xFFFF",
+    "-A": "-{y} & 0xFFFF",
+    "D+1": "(d + 1) & 0xFFFF",
+    "A+1": "({y} + 1) & 0xFFFF",
+    "D-1": "(d - 1) & 0xFFFF",
+    "A-1": "({y} - 1) & 0xFFFF",
+    "D+A": "(d + {y}) & 0xFFFF",
+    "D-A": "(d - {y}) & 0xFFFF",
+    "A-D": "({y} - d) & 0xFFFF",
+    "D&A": "d & {y}",
+    "D|A": "d | {y}",
+}
+
+# Whether a jump is taken, as Python source testing the (unsigned) output of
+# the computation. Keyed by the mnemonic of the assembler's JUMP_TABLE.
+JUMP_SOURCES = {
+    "JGT": "0 < {out} < 0x8000",
+    "JEQ": "{out} == 0",
+    "JGE": "{out} < 0x8000",
+    "JLT": "{out} >= 0x8000",
+    "JNE": "{out} != 0",
+    "JLE": "{out} == 0 or {out} >= 0x8000",
+    "JMP": "True",
+}
+
+COMP_FUNCTIONS = {
+    mnemonic: eval("lambda d, y: " + source.format(y="y"))
+    for mnemonic, source in COMP_SOURCES.items()
+}
+JUMP_FUNCTIONS = {
+    mnemonic: eval("lambda out: " + source.format(out="out"))
+    for mnemonic, source in JUMP_SOURCES.items()
+}
+JUMP_FUNCTIONS["null"] = None
+
+# The assembler's tables, inverted. Commutative aliases share their code
+# with the canonical form, which comes first.
+COMP_MNEMONICS = {}
+for _mnemonic, _code in HackAssembler.COMP_CODES.items():
+    COMP_MNEMONICS.setdefault(_code, _mnemonic)
+JUMP_MNEMONICS = {code: jump for jump, code in HackAssembler.JUMP_CODES.items()}
+
+
+def alu(code):
+    """Return the computation of a comp code that isn't in COMP_TABLE, by
+    simulating the ALU control bits zx, nx, zy, ny, f, no.
+    """
+    zx, nx, zy, ny, f, no = ((code >> (11 - i)) & 1 for i in range(6))
+
+    def compute(d, y):
+        x = 0 if zx else d
+        if nx:
+            x = ~x & WORD_MASK
+        if zy:
+            y = 0
+        if ny:
+            y = ~y & WORD_MASK
+        out = (x + y) & WORD_MASK if f else x & y
+        return ~out & WORD_MASK if no else out
+
+    return compute
+
+
+def decode(word):
+    """Predecode a word.
+
+    A instructions decode to the int loaded into A. C instructions decode to
+    a (comp, uses_m, dest_a, dest_d, dest_m, jump) tuple where comp computes
+    the output from D and A or M, and jump tells whether the jump is taken
+    from the output (or is None).
+    """
+    if not word & SIGN_BIT:
+        return word
+
+    code = word & COMP_MASK
+    mnemonic = COMP_MNEMONICS.get(code)
+    if mnemonic is not None:
+        comp = COMP_FUNCTIONS[mnemonic.replace("M", "A")]
+    else:
+        comp = alu(code)
+
+    return (
+        comp,
+        bool(word & A_BIT),
+        bool(word & (0b100 << 3)),
+        bool(word & (0b010 << 3)),
+        bool(word & (0b001 << 3)),
+        JUMP_FUNCTIONS[JUMP_MNEMONICS[word & 0b111]],
+    )
+
+
+def load_program(fn):
+    """Load the words of a .hack, .bin (little-endian), .binbe (big-endian)
+    or .asm file.
+    """
+    ext = os.path.splitext(fn)[1]
+    if ext in HackAssembler.ROM_BYTEORDERS:
+        return HackAssembler.load_rom(fn)
+    elif ext == ".asm":
+        with open(fn, "r") as f:
+            return HackAssembler.assemble(f)
+
+    return HackAssembler.load_hack(fn)
+
+
+# Hack pixels go from the least significant bit of each word, and 1 is
+# black. PNG pixels go from the most significant bit of each byte, and 1 is
+# white: reverse and invert each byte.
+PNG_BYTES = bytes(~int("{:08b}".format(i)[::-1], 2) & 0xFF for i in range(256))
+
+
+def png_chunk(typ, data):
+    return (struct.pack(">I", len(data)) + typ + data
+            + struct.pack(">I", zlib.crc32(typ + data)))
+
+
+def screen_to_png(snapshot):
+    """Encode a screen snapshot as a 1-bit grayscale PNG."""
+    pixels = snapshot.translate(PNG_BYTES)
+    rows = b"".join(b"\x00" + pixels[i:i + ROW_BYTES]  # No filter
+                    for i in range(0, len(pixels), ROW_BYTES))
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        png_chunk(b"IHDR", struct.pack(">IIBBBBB", SCREEN_WIDTH, SCREEN_HEIGHT, 1, 0, 0, 0, 0)),
+        png_chunk(b"IDAT", zlib.compress(rows)),
+        png_chunk(b"IEND", b""),
+    ])
+
+
+def screen_diff(before, after):
+    """Compare two screen snapshots. Return the number of pixels that
+    differ and the list of rows they're on.
+    """
+    if before == after:
+        return 0, []
+
+    changed = int.from_bytes(before, "little") ^ int.from_bytes(after, "little")
+    rows = [row for row, i in enumerate(range(0, len(before), ROW_BYTES))
+            if before[i:i + ROW_BYTES] != after[i:i + ROW_BYTES]]
+    return bin(changed).count("1"), rows
+
+
+def load_leaders(fn):
+    """Return the label positions of an .asm file, where blocks start. Other
+    formats have no labels.
+    """
+    if os.path.splitext(fn)[1] != ".asm":
+        return set()
+
+    with open(fn, "r") as f:
+        _, labels = HackAssembler.parse(f)
+
+    return set(labels.values())
+
+
+class CPU():
+    def __init__(self, words=()):
+        self.clear()
+        self.load(words)
+        self.reset()
+
+    def clear(self):
+        """Allocate fresh, zeroed RAM."""
+        # A contiguous buffer of 16-bit words. Values must be unsigned.
+        self.ram = array("H", bytes(2 * RAM_SIZE))
+        # Zero-copy view of the screen memory map
+        self.screen = memoryview(self.ram)[SCREEN:KBD]
+
+    def screen_snapshot(self):
+        """Return a copy of the screen memory as bytes, in little-endian
+        word order: each byte holds 8 pixels, leftmost in the lowest bit.
+        """
+        if sys.byteorder == "little":
+            return self.screen.tobytes()
+
+        screen = array("H", self.screen)
+        screen.byteswap()
+        return screen.tobytes()
+
+    def load(self, words):
+        """Load a program into ROM, predecoding every word."""
+        self.rom = list(words)
+        self.program = [decode(word) for word in self.rom]
+
+    def reset(self):
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.halted = False
+
+    def run(self, steps):
+        """Execute up to steps instructions. Stop early if the program runs
+        off the end of ROM or halts, jumping to itself in a tight loop
+        ('(END) @END 0;JMP'). Return the number of instructions executed.
+        """
+        program = self.program
+        ram = self.ram
+        a, d, pc = self.a, self.d, self.pc
+        size = len(program)
+        step = 0
+        while step < steps:
+            if pc >= size:
+                break
+            step += 1
+            insn = program[pc]
+            if insn.__class__ is int:
+                a = insn
+                pc += 1
+                continue
+
+            comp, uses_m, dest_a, dest_d, dest_m, jump = insn
+            out = comp(d, ram[a] if uses_m else a)
+            if dest_m:
+                ram[a] = out
+            if jump is not None and jump(out):
+                if a == pc - 1 and program[a] == a and not (dest_a or dest_d or dest_m):
+                    self.halted = True
+                    pc = a
+                    break
+                pc = a
+            else:
+                pc += 1
+            if dest_a:
+                a = out
+            if dest_d:
+                d = out
+
+        self.a, self.d, self.pc = a, d, pc
+        return step
+
+
+class BlockCPU(CPU):
+    """A CPU that compiles each straight-line block of ROM into a Python
+    function the first time it's entered, and caches it.
+
+    Blocks end at jumps, at the end of ROM, and before any of the given
+    leaders (e.g. the label positions from HackAssembler.parse) so blocks
+    entered through a label don't overlap.
+    """
+    def __init__(self, words=(), leaders=()):
+        self.leaders = frozenset(leaders)
+        super().__init__(words)
+
+    def load(self, words):
+        super().load(words)
+        # Entry pc -> (function, number of instructions), or None for blocks
+        # that halt and are left to the interpreter
+        self.blocks = [False] * len(self.rom)
+
+    def halts_at(self, pc):
+        """Return whether the program halts at pc: '(END) @END 0;JMP'."""
+        rom = self.rom
+        return 0 <= pc < len(rom) - 1 and rom[pc] == pc and rom[pc + 1] == HALT_JUMP
+
+    def compile_block(self, start):
+        """Compile the block starting at start into a function taking
+        (ram, a, d) and returning the new (a, d, pc).
+        """
+        rom = self.rom
+        if self.halts_at(start) or self.halts_at(start - 1):
+            return None
+
+        namespace = {}
+        lines = ["def block(ram, a, d):"]
+        # The value of A when it's known at compile time
+        known_a = None
+        pc = start
+        while pc < len(rom):
+            word = rom[pc]
+            pc += 1
+            if not word & SIGN_BIT:
+                lines.append("    a = {}".format(word))
+                known_a = word
+            else:
+                a = "a" if known_a is None else str(known_a)
+                m = "ram[{}]".format(a)
+                code = word & COMP_MASK
+                mnemonic = COMP_MNEMONICS.get(code)
+                y = m if word & A_BIT else a
+                if mnemonic is not None:
+                    expr = COMP_SOURCES[mnemonic.replace("M", "A")].format(y=y)
+                else:
+                    name = "alu_{}".format(code)
+                    namespace[name] = alu(code)
+                    expr = "{}(d, {})".format(name, y)
+
+                jump = JUMP_MNEMONICS[word & 0b111]
+                targets = []
+                if word & (0b001 << 3):
+                    targets.append(m)
+                if word & (0b010 << 3):
+                    targets.append("d")
+                if jump != "null" and a == "a":
+                    lines.append("    target = a")
+                    a = "target"
+                if word & (0b100 << 3):
+                    targets.append("a")
+                    known_a = None
+
+                if len(targets) == 1 and jump == "null":
+                    lines.append("    {} = {}".format(targets[0], expr))
+                else:
+                    lines.append("    out = {}".format(expr))
+                    lines.extend("    {} = out".format(target) for target in targets)
+
+                if jump != "null":
+                    if jump == "JMP":
+                        lines.append("    return a, d, {}".format(a))
+                        break
+                    lines.append("    if {}:".format(JUMP_SOURCES[jump].format(out="out")))
+                    lines.append("        return a, d, {}".format(a))
+                    break
+
+            if pc in self.leaders or self.halts_at(pc):
+                break
+
+        lines.append("    return a, d, {}".format(pc))
+        exec(compile("\n".join(lines), "<block {}>".format(start), "exec"), namespace)
+        return namespace["block"], pc - start
+
+    def run(self, steps):
+        """Like CPU.run, a block at a time. The interpreter takes over for
+        halting blocks and when fewer steps are left than a block's length.
+        """
+        blocks = self.blocks
+        ram = self.ram
+        a, d, pc = self.a, self.d, self.pc
+        size = len(blocks)
+        step = 0
+        while step < steps and pc < size:
+            block = blocks[pc]
+            if block is False:
+                block = blocks[pc] = self.compile_block(pc)
+            if block is None or step + block[1] > steps:
+                break
+            a, d, pc = block[0](ram, a, d)
+            step += block[1]
+
+        self.a, self.d, self.pc = a, d, pc
+        if step < steps and pc < size:
+            step += super().run(steps - step)
+
+        return step
+
+
+def main(fn, steps=10000000, png=None):
+    cpu = BlockCPU(load_program(fn), load_leaders(fn))
+    start = time.perf_counter()
+    executed = cpu.run(int(steps))
+    elapsed = time.perf_counter() - start
+
+    print("{} instructions in {:.3f}s ({:.0f}/s){}".format(
+        executed, elapsed, executed / elapsed if elapsed else 0,
+        ", halted" if cpu.halted else ""))
+    for addr in range(16):
+        print("RAM[{}] = {}".format(addr, cpu.ram[addr]))
+
+    if png:
+        with open(png, "wb") as f:
+            f.write(screen_to_png(cpu.screen_snapshot()))
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: {} <hack, bin or assembly file> [steps] [screen png]".format(sys.argv[0]))
+        sys.exit(1)
+
+    main(*sys.argv[1:])
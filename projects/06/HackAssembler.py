@@ -2,7 +2,12 @@
 
 import sys
 import os
+import mmap
+import tempfile
+from array import array
 from collections import namedtuple
+from functools import lru_cache
+from itertools import islice
 
 # Sets bits a, c1, c2, c3, c4, c5, c6
 COMP_TABLE = {
@@ -34,6 +39,13 @@ COMP_TABLE = {
     "M-D": "1000111",
     "D&M": "1000000",
     "D|M": "1010101",
+    # Commutative forms, as emitted by VMTranslator.py
+    "A+D": "0000010",
+    "A&D": "0000000",
+    "A|D": "0010101",
+    "M+D": "1000010",
+    "M&D": "1000000",
+    "M|D": "1010101",
 }
 
 # Sets bits d1, d2, d3
@@ -89,110 +101,276 @@ BUILTIN_SYMBOLS = {
 FIRST_FREE_ADDR = 16
 CODE_START = 0
 
-AInstruction = namedtuple("AInstruction", "symbol")
+# Output format: (file extension, byte order). The ascii/binary .hack format
+# has no byte order. Each byte order gets its own extension, so loaders can
+# tell them apart.
+OUTPUT_FORMATS = {
+    "hack": ("hack", None),
+    "le": ("bin", "little"),
+    "be": ("binbe", "big"),
+}
+# Byte order of the packed ROM images, by file extension
+ROM_BYTEORDERS = {"." + ext: byteorder for ext, byteorder in OUTPUT_FORMATS.values() if byteorder}
+# Number of words packed at a time when streaming a binary ROM image
+STREAM_CHUNK = 4096
+
+# Integer versions of the tables above, already shifted into position
+C_PREFIX = 0b111 << 13
+COMP_CODES = {comp: int(bits, 2) << 6 for comp, bits in COMP_TABLE.items()}
+DEST_CODES = {dest: int(bits, 2) << 3 for dest, bits in DEST_TABLE.items()}
+JUMP_CODES = {jump: int(bits, 2) for jump, bits in JUMP_TABLE.items()}
+
 CInstruction = namedtuple("CInstruction", "dest comp jump")
 
 
+def strip_line(line):
+    """Remove comments and whitespace from a line of assembly. Whitespace is
+    allowed inside instructions, as in "D; JNE".
+    """
+    line = line.split("//", 1)[0].strip()
+    if " " in line or "\t" in line:
+        line = "".join(line.split())
+    return line
+
+
 def parse_a_instruction(line):
+    """Return the encoded word for a numeric A instruction, or the symbol
+    name if it must be resolved once the symbol table is complete.
+    """
     symbol = line[1:]
+    if symbol.isdigit():
+        return encode_address(int(symbol))
 
-    return AInstruction(symbol)
+    return symbol
 
 
 def parse_c_instruction(line):
-    if "=" in line:
-        dest, rest = line.split("=")
-    else:
+    dest, eq, rest = line.partition("=")
+    if not eq:
         dest = "null"
         rest = line
 
-    if ";" in rest:
-        comp, jump = rest.split(";")
-    else:
-        comp = rest
-        jump = "null"
-
-    return CInstruction(dest, comp, jump)
+    comp, _, jump = rest.partition(";")
 
+    return CInstruction(dest, comp, jump or "null")
 
-def encode_a_instruction(insn, symbols):
-    """Take an AInstruction and return its ascii/binary representation."""
-    try:
-        addr = int(insn.symbol)
-    except:
-        addr = symbols[insn.symbol]
 
+def encode_address(addr):
+    """Take an address and return its A instruction word."""
     if addr >= (1 << 15):
         raise ValueError("Address {} cannot be encoded in 15 bits".format(addr))
 
-    return "0{:015b}".format(addr)
+    return addr
 
 
 def encode_c_instruction(insn):
-    """Take an CInstruction and return its ascii/binary representation."""
-    dest_bits = DEST_TABLE[insn.dest]
-    comp_bits = COMP_TABLE[insn.comp]
-    jump_bits = JUMP_TABLE[insn.jump]
-    return "111{}{}{}".format(comp_bits, dest_bits, jump_bits)
+    """Take an CInstruction and return its word."""
+    return (C_PREFIX
+            | COMP_CODES[insn.comp]
+            | DEST_CODES[insn.dest]
+            | JUMP_CODES[insn.jump])
 
 
-def main(fn):
-    # Iterate through
-    with open(fn, "r") as f:
-        lines = f.readlines()
+@lru_cache(maxsize=None)
+def encode_c_line(line):
+    """Parse and encode a C instruction. Programs only use a handful of
+    distinct C instructions, so each one is only ever parsed once.
+    """
+    return encode_c_instruction(parse_c_instruction(line))
 
-    symbols = {}
-    symbols.update(BUILTIN_SYMBOLS)
 
-    # First pass
-    code_addr = 0
+def parse(lines, strip=True):
+    """First pass: parse each line once.
+
+    Return the program, a list holding an int for every instruction that
+    could be encoded right away and a symbol name for every A instruction
+    that couldn't, and a dict of the label positions.
+    Lines generated in-process that hold no comments or whitespace don't
+    need to be stripped.
+    """
+    program = []
+    labels = {}
     for line in lines:
-        line = line.strip()
-        # Trim off comments
-        line = line.split(" ")[0]
-        if line == "" or line.startswith("//"):
+        if strip:
+            line = strip_line(line)
+        if not line:
             continue
-        if line.startswith("("):
-            symbol = line.lstrip("(").rstrip(")")
-            symbols[symbol] = code_addr
+        if line[0] == "(":
+            labels[line[1:-1]] = len(program)
+        elif line[0] == "@":
+            program.append(parse_a_instruction(line))
         else:
-            code_addr += 1
+            program.append(encode_c_line(line))
 
-    # Second pass
-    next_addr = FIRST_FREE_ADDR
+    return program, labels
+
+
+def parse_instructions(lines):
+    """Yield the compact form of each instruction, skipping labels."""
+    for line in lines:
+        line = strip_line(line)
+        if not line or line[0] == "(":
+            continue
+        if line[0] == "@":
+            yield parse_a_instruction(line)
+        else:
+            yield encode_c_line(line)
+
+
+def scan_labels(lines):
+    """First pass of the streaming assembler: only record label positions."""
+    labels = {}
     code_addr = CODE_START
-    output = []
     for line in lines:
-        line = line.strip()
-        # Trim off comments
-        line = line.split(" ")[0]
-        if line == "" or line.startswith("//") or line.startswith("("):
+        line = strip_line(line)
+        if not line:
             continue
+        if line[0] == "(":
+            labels[line[1:-1]] = code_addr
+        else:
+            code_addr += 1
+
+    return labels
+
+
+def iter_resolve(program, symbols):
+    """Second pass: replace symbol names in the program by their addresses,
+    allocating a new variable for each symbol that isn't known yet.
+    Yield the words.
+    """
+    next_addr = FIRST_FREE_ADDR
+    for insn in program:
+        if insn.__class__ is str:
+            addr = symbols.get(insn)
+            if addr is None:
+                addr = symbols[insn] = next_addr
+                next_addr += 1
+            insn = encode_address(addr)
+        yield insn
+
+
+def resolve(program, symbols):
+    """Resolve the whole program, returning the list of words."""
+    return list(iter_resolve(program, symbols))
+
+
+def make_symbols(labels):
+    """Return a new symbol table holding the builtin symbols and labels."""
+    symbols = {}
+    symbols.update(BUILTIN_SYMBOLS)
+    symbols.update(labels)
+    return symbols
+
+
+def assemble(lines, strip=True):
+    """Assemble an iterable of lines of assembly into a list of words."""
+    program, labels = parse(lines, strip)
+
+    return resolve(program, make_symbols(labels))
+
+
+def spool(lines, f):
+    """Yield lines, keeping a copy in f so they can be read again."""
+    for line in lines:
+        f.write(line)
+        yield line
+
+
+def stream(src, dst, byteorder=None):
+    """Assemble the file object src, writing words to dst as they're encoded.
+
+    Only the symbol table is kept in memory. The source is read twice: a
+    source that can't be rewound (e.g. a pipe) is spooled to a temporary
+    file during the first pass.
+    """
+    with tempfile.TemporaryFile("w+") as tmp:
+        if src.seekable():
+            start = src.tell()
+            labels = scan_labels(src)
+            src.seek(start)
         else:
-            if line.startswith("@"):  # 'A' instruction
-                ainst = parse_a_instruction(line)
-                try:
-                    int(ainst.symbol)
-                except:
-                    if ainst.symbol not in symbols:
-                        symbols[ainst.symbol] = next_addr
-                        next_addr += 1
-                insn = encode_a_instruction(ainst, symbols)
-            else:  # 'C' instruction
-                cinst = parse_c_instruction(line)
-                insn = encode_c_instruction(cinst)
-
-            output.append(insn)
-
-            code_addr += 1  # needed?
+            labels = scan_labels(spool(src, tmp))
+            tmp.seek(0)
+            src = tmp
+
+        words = iter_resolve(parse_instructions(src), make_symbols(labels))
+        write_words(words, dst, byteorder)
+
+
+def write_words(words, f, byteorder=None):
+    """Write words to f incrementally, either in the ascii/binary .hack
+    format (no byte order) or as a packed ROM image.
+    """
+    words = iter(words)
+    if byteorder is None:
+        for word in words:
+            f.write("{:016b}".format(word))
+            break
+        f.writelines(map("\n{:016b}".format, words))
+        return
+
+    rom = pack(islice(words, STREAM_CHUNK), byteorder)
+    while rom:
+        rom.tofile(f)
+        rom = pack(islice(words, STREAM_CHUNK), byteorder)
+
+
+def pack(words, byteorder="little"):
+    """Pack words into a 16-bit ROM image with the given byte order."""
+    rom = array("H", words)
+    if byteorder != sys.byteorder:
+        rom.byteswap()
+
+    return rom
+
+
+def load_rom(fn, byteorder=None):
+    """Load a packed binary ROM image and return its words. The byte order
+    is taken from the file's extension unless given.
+
+    Images in the machine's native byte order are memory-mapped instead of
+    being read in, so nothing is copied until a word is actually accessed.
+    """
+    if byteorder is None:
+        byteorder = ROM_BYTEORDERS[os.path.splitext(fn)[1]]
+    with open(fn, "rb") as f:
+        if byteorder == sys.byteorder and os.fstat(f.fileno()).st_size:
+            rom = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(rom).cast("H")
+
+        rom = array("H")
+        rom.frombytes(f.read())
+
+    if byteorder != sys.byteorder:
+        rom.byteswap()
+
+    return rom
+
+
+def load_hack(fn):
+    """Load an ascii/binary .hack file and return its words."""
+    with open(fn, "r") as f:
+        return array("H", (int(line, 2) for line in f if line.strip()))
+
+
+def main(fn, fmt="hack"):
+    ext, byteorder = OUTPUT_FORMATS[fmt]
+    if fn == "-":
+        # Stream from stdin (e.g. piped from VMTranslator.py) to stdout
+        dst = sys.stdout if byteorder is None else sys.stdout.buffer
+        stream(sys.stdin, dst, byteorder)
+        return
+
+    with open(fn, "r") as f:
+        words = assemble(f)
 
     fnroot = os.path.splitext(fn)[0]
-    with open("{}.hack".format(fnroot), "w") as f:
-        f.write("\n".join(output))
+    with open("{}.{}".format(fnroot, ext), "w" if byteorder is None else "wb") as f:
+        write_words(words, f, byteorder)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: {} <assembly file>".format(sys.argv[0]))
+    if len(sys.argv) not in (2, 3) or sys.argv[2:] and sys.argv[2] not in OUTPUT_FORMATS:
+        print("Usage: {} <assembly file or -> [{}]".format(sys.argv[0], "|".join(OUTPUT_FORMATS)))
         sys.exit(1)
 
-    main(sys.argv[1])
+    main(*sys.argv[1:])
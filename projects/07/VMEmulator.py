@@ -0,0 +1,364 @@
+#!/bin/env python
+
+import sys
+import time
+import os.path as op
+
+import VMTranslator
+import vm_builtins
+
+# The memory layout and screen helpers are the CPU emulator's
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), "..", "06"))
+import CPUEmulator
+
+WORD_MASK = CPUEmulator.WORD_MASK
+SIGN_BIT = CPUEmulator.SIGN_BIT
+TRUE = WORD_MASK
+
+STACK_BASE = 256
+STATIC_BASE = 16
+# Pointers of the segments accessed indirectly
+SEGMENT_POINTERS = {
+    "local": 1,  # LCL
+    "argument": 2,  # ARG
+    "this": 3,  # THIS
+    "that": 4,  # THAT
+}
+# Base addresses of the segments at fixed locations
+SEGMENT_BASES = {
+    "pointer": 3,
+    "temp": 5,
+}
+FRAME_SIZE = 5
+FLAGS = {
+    # Run the OS functions natively
+    "-b": {"builtins": True},
+}
+
+# Opcodes of resolved commands, roughly most frequent first
+(PUSH_CONSTANT, PUSH_INDIRECT, PUSH_DIRECT, POP_INDIRECT, POP_DIRECT, ADD, SUB,
+ IF_GOTO, GOTO, EQ, GT, LT, AND, OR, NOT, NEG, CALL, BUILTIN, FUNCTION, RETURN) = range(20)
+
+BINARY_OPS = {"add": ADD, "sub": SUB, "eq": EQ, "gt": GT, "lt": LT, "and": AND, "or": OR}
+UNARY_OPS = {"not": NOT, "neg": NEG}
+
+
+def load_commands(files):
+    """Parse the .vm files in order. Return the list of (filename, command)."""
+    commands = []
+    for fn in files:
+        filename = op.basename(op.splitext(fn)[0])
+        with open(fn, "r") as f:
+            for line in f:
+                command = VMTranslator.parse_line(line)
+                if command:
+                    commands.append((filename, command))
+
+    return commands
+
+
+def add_os(files, bootstrap=False):
+    """Return the .vm files followed by those of the OS classes they call
+    but lack, from the supplied OS in tools/OS, like the Java VM emulator.
+    With bootstrap, Sys is needed to start.
+    """
+    files = list(files)
+    classes = {op.splitext(op.basename(fn))[0] for fn in files}
+    pending = list(files)
+
+    def need(name):
+        vm = op.join(vm_builtins.OS_DIR, "{}.vm".format(name))
+        if name not in classes and op.exists(vm):
+            files.append(vm)
+            pending.append(vm)
+            classes.add(name)
+
+    if bootstrap:
+        need("Sys")
+    while pending:
+        for _, command in load_commands([pending.pop()]):
+            if command.command == "call":
+                need(command.arg1.split(".")[0])
+
+    return files
+
+
+def scan_labels(commands):
+    """Return the index in the resolved program of every function and label.
+    Labels are scoped by function, like the translator's, and take no room in
+    the resolved program.
+    """
+    functions = {}
+    labels = {}
+    index = 0
+    function = None
+    for filename, command in commands:
+        if command.command == "label":
+            labels[(function, command.arg1)] = index
+            continue
+        if command.command == "function":
+            function = command.arg1
+            functions[function] = index
+        index += 1
+
+    return functions, labels
+
+
+def resolve(commands, builtins={}):
+    """Resolve the commands to a list of (opcode, x, y) tuples, where labels
+    and functions are program indices and segments are addresses or pointer
+    registers, and return it with the function indices and the addresses of
+    the static variables. Calls to the functions in builtins call those
+    instead.
+
+    Static variables get addresses in order of first use, from 16, the same
+    as the assembler gives them to the translator's symbols.
+    """
+    functions, labels = scan_labels(commands)
+    statics = {}
+    program = []
+    function = None
+
+    def address(filename, segment, index):
+        if segment == "static":
+            symbol = "{}.{}".format(filename, index)
+            return statics.setdefault(symbol, STATIC_BASE + len(statics))
+        return SEGMENT_BASES[segment] + index
+
+    for filename, command in commands:
+        name = command.command
+        if name == "label":
+            continue
+        if name in {"push", "pop"}:
+            segment, index = command.arg1, int(command.arg2)
+            if segment == "constant":
+                resolved = (PUSH_CONSTANT, index & WORD_MASK, None)
+            elif segment in SEGMENT_POINTERS:
+                resolved = (PUSH_INDIRECT if name == "push" else POP_INDIRECT,
+                      SEGMENT_POINTERS[segment], index)
+            else:
+                resolved = (PUSH_DIRECT if name == "push" else POP_DIRECT,
+                      address(filename, segment, index), None)
+        elif name in BINARY_OPS or name in UNARY_OPS:
+            resolved = (BINARY_OPS.get(name, UNARY_OPS.get(name)), None, None)
+        elif name in {"goto", "if-goto"}:
+            target = labels.get((function, command.arg1))
+            if target is None:
+                raise ValueError("Undefined label: {}".format(command.line))
+            resolved = (GOTO if name == "goto" else IF_GOTO, target, None)
+        elif name == "function":
+            function = command.arg1
+            resolved = (FUNCTION, int(command.arg2), None)
+        elif name == "call":
+            if command.arg1 not in functions:
+                raise ValueError("Undefined function: {}".format(command.line))
+            if command.arg1 in builtins:
+                resolved = (BUILTIN, builtins[command.arg1], int(command.arg2))
+            else:
+                resolved = (CALL, functions[command.arg1], int(command.arg2))
+        else:  # return
+            resolved = (RETURN, None, None)
+        program.append(resolved)
+
+    return program, functions, statics
+
+
+class VM():
+    """Executes VM commands directly, on the same RAM layout as the
+    translated code running on the CPU.
+    """
+    # Same RAM and screen as the CPU
+    clear = CPUEmulator.CPU.clear
+    screen_snapshot = CPUEmulator.CPU.screen_snapshot
+
+    def __init__(self, files=(), bootstrap=False, builtins=False):
+        self.clear()
+        self.load(files, bootstrap, builtins)
+        self.reset()
+
+    def load(self, files, bootstrap=False, builtins=False):
+        """Load and resolve the .vm files. With bootstrap, execution starts
+        by calling Sys.init, with the stack at 256. With builtins, the OS
+        functions run natively if the supplied OS is loaded (see
+        vm_builtins).
+        """
+        commands = load_commands(files)
+        if builtins:
+            self.builtins = vm_builtins.bind([command for _, command in commands])
+        else:
+            self.builtins = {}
+        self.program, self.functions, self.statics = resolve(commands, self.builtins)
+        self.bootstrap = bootstrap
+
+    def reset(self):
+        self.pc = 0
+        self.halted = False
+        if self.bootstrap:
+            self.ram[0] = STACK_BASE
+            # Returning from Sys.init runs off the end of the program
+            self.call(self.functions["Sys.init"], 0, len(self.program))
+
+    def call(self, target, num_args, return_address):
+        """Save the caller's frame and jump to target."""
+        ram = self.ram
+        sp = ram[0]
+        ram[sp] = return_address
+        ram[sp + 1] = ram[1]
+        ram[sp + 2] = ram[2]
+        ram[sp + 3] = ram[3]
+        ram[sp + 4] = ram[4]
+        ram[2] = sp - num_args
+        ram[0] = ram[1] = sp + FRAME_SIZE
+        self.pc = target
+
+    def run(self, steps):
+        """Execute up to steps commands. Stop early if the program runs off
+        its end or halts, jumping to itself in a tight loop. Return the
+        number of commands executed.
+        """
+        if self.halted:
+            return 0
+        program = self.program
+        ram = self.ram
+        pc = self.pc
+        size = len(program)
+        step = 0
+        while step < steps:
+            if pc >= size:
+                break
+            step += 1
+            opcode, x, y = program[pc]
+            pc += 1
+            if opcode == PUSH_CONSTANT:
+                sp = ram[0]
+                ram[sp] = x
+                ram[0] = sp + 1
+            elif opcode == PUSH_INDIRECT:
+                value = ram[(ram[x] + y) & WORD_MASK]
+                sp = ram[0]
+                ram[sp] = value
+                ram[0] = sp + 1
+            elif opcode == PUSH_DIRECT:
+                sp = ram[0]
+                ram[sp] = ram[x]
+                ram[0] = sp + 1
+            elif opcode == POP_INDIRECT:
+                addr = (ram[x] + y) & WORD_MASK
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[addr] = ram[sp]
+            elif opcode == POP_DIRECT:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[x] = ram[sp]
+            elif opcode <= LT:
+                # Binary operators, conditional and unconditional jumps
+                if opcode == GOTO:
+                    if x == pc - 1:
+                        self.halted = True
+                        pc = x
+                        break
+                    pc = x
+                    continue
+                sp = ram[0] - 1
+                ram[0] = sp
+                if opcode == IF_GOTO:
+                    if ram[sp]:
+                        if x == pc - 1:
+                            self.halted = True
+                            pc = x
+                            break
+                        pc = x
+                    continue
+                sp -= 1
+                a, b = ram[sp], ram[sp + 1]
+                if opcode == ADD:
+                    ram[sp] = (a + b) & WORD_MASK
+                elif opcode == SUB:
+                    ram[sp] = (a - b) & WORD_MASK
+                else:
+                    # Compared on the 16-bit difference, like the translated code
+                    diff = (a - b) & WORD_MASK
+                    if opcode == EQ:
+                        ram[sp] = TRUE if diff == 0 else 0
+                    elif opcode == GT:
+                        ram[sp] = TRUE if 0 < diff < SIGN_BIT else 0
+                    else:
+                        ram[sp] = TRUE if diff >= SIGN_BIT else 0
+            elif opcode == AND:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[sp - 1] &= ram[sp]
+            elif opcode == OR:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[sp - 1] |= ram[sp]
+            elif opcode == NOT:
+                sp = ram[0] - 1
+                ram[sp] ^= WORD_MASK
+            elif opcode == NEG:
+                sp = ram[0] - 1
+                ram[sp] = -ram[sp] & WORD_MASK
+            elif opcode == CALL:
+                self.call(x, y, pc)
+                pc = self.pc
+            elif opcode == BUILTIN:
+                sp = ram[0] - y
+                args = map(vm_builtins.to_signed, ram[sp:sp + y])
+                try:
+                    value = x(self, *args)
+                except vm_builtins.Halt:
+                    self.halted = True
+                    pc -= 1
+                    break
+                ram[sp] = value & WORD_MASK
+                ram[0] = sp + 1
+            elif opcode == FUNCTION:
+                sp = ram[0]
+                for addr in range(sp, sp + x):
+                    ram[addr] = 0
+                ram[0] = sp + x
+            else:  # RETURN
+                frame = ram[1]
+                return_address = ram[frame - 5]
+                arg = ram[2]
+                ram[arg] = ram[ram[0] - 1]
+                ram[0] = arg + 1
+                ram[1] = ram[frame - 4]
+                ram[2] = ram[frame - 3]
+                ram[3] = ram[frame - 2]
+                ram[4] = ram[frame - 1]
+                pc = return_address
+
+        self.pc = pc
+        return step
+
+
+def main(filepath, steps=10000000, png=None, builtins=False):
+    path, module, files, bootstrap = VMTranslator.find_files(filepath)
+    vm = VM(add_os(files, bootstrap), bootstrap, builtins)
+    if builtins and not vm.builtins:
+        print("Warning: the OS functions run as VM code, since the loaded OS "
+              "isn't the supplied one", file=sys.stderr)
+    start = time.perf_counter()
+    executed = vm.run(int(steps))
+    elapsed = time.perf_counter() - start
+
+    print("{} commands in {:.3f}s ({:.0f}/s){}".format(
+        executed, elapsed, executed / elapsed if elapsed else 0,
+        ", halted" if vm.halted else ""))
+    for addr in range(16):
+        print("RAM[{}] = {}".format(addr, vm.ram[addr]))
+
+    if png:
+        with open(png, "wb") as f:
+            f.write(CPUEmulator.screen_to_png(vm.screen_snapshot()))
+
+if __name__ == "__main__":
+    args, options = VMTranslator.parse_flags(sys.argv[1:], FLAGS)
+    if len(args) not in (1, 2, 3):
+        print("Usage: {} [{}] <vm file or path> [steps] [screen png]".format(
+            sys.argv[0], "] [".join(FLAGS)))
+        sys.exit(1)
+
+    main(*args, **options)
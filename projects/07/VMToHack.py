@@ -0,0 +1,32 @@
+#!/bin/env python
+
+import sys
+import os.path as op
+
+import VMTranslator
+
+# The assembler lives with project 06
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), "..", "06"))
+import HackAssembler
+
+
+def main(filepath, fmt="hack", **options):
+    """Translate and assemble in one go, without writing or re-reading an
+    intermediate .asm file: the translator's instructions are fed straight
+    into the assembler.
+    """
+    ext, byteorder = HackAssembler.OUTPUT_FORMATS[fmt]
+    path, module, asm = VMTranslator.translate_program(filepath, comments=False, **options)
+    words = HackAssembler.assemble(asm, strip=False)
+
+    with open(op.join(path, "{}.{}".format(module, ext)), "w" if byteorder is None else "wb") as f:
+        HackAssembler.write_words(words, f, byteorder)
+
+if __name__ == "__main__":
+    args, options = VMTranslator.parse_flags(sys.argv[1:])
+    if len(args) not in (1, 2) or args[1:] and args[1] not in HackAssembler.OUTPUT_FORMATS:
+        print("Usage: {} [{}] <vm file or path> [{}]".format(
+            sys.argv[0], "] [".join(VMTranslator.FLAGS), "|".join(HackAssembler.OUTPUT_FORMATS)))
+        sys.exit(1)
+
+    main(*args, **options)
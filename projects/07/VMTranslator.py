@@ -4,15 +4,29 @@ import sys
 import glob
 import os.path as op
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 
 import translations
+import peephole
+import vm_optimizer
+import vm_cache
 
 Command = namedtuple("Command", "line type command arg1 arg2")
 
 ARITH_COMMANDS = {"add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"}
 MEM_COMMANDS = {"pop", "push"}
 BRANCH_COMMANDS = {"goto", "if-goto", "label"}
+FLAGS = {
+    # Optimize
+    "-O": {"optimize": True},
+    # Optimize, trading speed for size
+    "-Os": {"optimize": True, "size": True},
+    # Translate the files of a directory in parallel
+    "-j": {"parallel": True},
+    # Reuse the translations of unchanged files from the cache
+    "-c": {"cache": True},
+}
 
 COMMAND_MAP = {
     "push": translations.push_command,
@@ -32,6 +46,9 @@ COMMAND_MAP = {
     "function": translations.function_command,
     "call": translations.call_command,
     "return": translations.return_command,
+    # Only produced by the VM optimizer
+    "move": translations.move_command,
+    "drop": translations.drop_command,
 }
 
 
@@ -58,8 +75,8 @@ def parse_line(line):
 
 
 
-def translate_command(command):
-    """Takes a VM command and translates it to hack assembly.
+def translate_command(ctx, command, comments=True):
+    """Takes a VM command and translates it to hack assembly in ctx.
     Return a list of assembly instructions.
     """
     if not command:
@@ -67,49 +84,177 @@ def translate_command(command):
 
     ins = []
     # Add the original VM command as a comment
-    ins.append("// {}".format(command.line))
+    if comments:
+        ins.append("// {}".format(command.line))
     # Translate the command into assembly
-    asm = COMMAND_MAP[command.command](command)
+    asm = COMMAND_MAP[command.command](ctx, command)
 
     ins.extend(asm)
 
     return ins
 
 
-def main(filepath):
-    asm = []
+def find_files(filepath):
+    """Return the output path, the module name, the .vm files to translate,
+    and whether bootstrapping code is needed.
+    """
     if op.isdir(filepath):
         path = filepath
         module = op.basename(op.normpath(op.realpath(filepath)))
-        files = glob.glob("{}/*.vm".format(filepath))
-        asm.extend(translations.bootstrap())
+        files = sorted(glob.glob("{}/*.vm".format(filepath)))
+        return path, module, files, True
     else:
         path = op.dirname(filepath)
         module = op.splitext(op.basename(filepath))[0]
-        files = [filepath]
+        return path, module, [filepath], False
+
+
+def translate_file(ctx, fn, comments=True, optimize=False):
+    """Translate a .vm file in ctx, yielding assembly instructions.
+    """
+    ctx.filename = op.basename(op.splitext(fn)[0])
+    # Read in lines
+    with open(fn, "r") as f:
+        lines = f.readlines()
 
+    # Parse and translate each line
+    commands = map(parse_line, lines)
+    if optimize:
+        commands = vm_optimizer.optimize(commands)
+    ctx.count = 0
+    for command in commands:
+        ctx.count += 1
+        yield from translate_command(ctx, command, comments)
+
+
+def translate(files, bootstrap=False, comments=True, optimize=False, shared_cmp=False):
+    """Translate the .vm files in order, in a context of their own, yielding
+    assembly instructions.
+    """
+    ctx = translations.Context(shared_cmp=shared_cmp)
+    if bootstrap:
+        yield from translations.bootstrap(ctx)
 
     for fn in files:
-        # UGLY: Filename must communicated with the translator
-        translations.filename = op.basename(op.splitext(fn)[0])
-        # Read in lines
-        with open(fn, "r") as f:
-            lines = f.readlines()
-
-        # Parse and translate each line
-        translations.count = 0
-        for line in lines:
-            command = parse_line(line)
-            translations.count += 1
-            asm.extend(translate_command(command))
+        yield from translate_file(ctx, fn, comments, optimize)
+
+
+def translate_separately(fn, comments=True, optimize=False, shared_cmp=False):
+    """Translate a .vm file in a context of its own, leaving out the stubs.
+    Return the instructions and the labels of the stubs used.
+    """
+    ctx = translations.Context(inline_stubs=False, shared_cmp=shared_cmp)
+    asm = list(translate_file(ctx, fn, comments, optimize))
+    return asm, ctx.stubs
+
+
+def translate_parallel(files, bootstrap=False, comments=True, optimize=False,
+                       shared_cmp=False, jobs=None):
+    """Translate the .vm files concurrently in a process pool and stitch them
+    back together in order, followed by the stubs they use.
+    Return the list of instructions.
+    """
+    worker = partial(translate_separately, comments=comments, optimize=optimize,
+                     shared_cmp=shared_cmp)
+    with ProcessPoolExecutor(jobs) as pool:
+        results = list(pool.map(worker, files))
+
+    return link(results, bootstrap, shared_cmp)
+
+
+def translate_cached(files, cache_dir, bootstrap=False, comments=True, optimize=False,
+                     shared_cmp=False, parallel=False, complete=False):
+    """Like translate_parallel, but reuse the translations of unchanged files
+    from the cache in cache_dir, and only translate (and cache) the others.
+    complete means files are all the .vm files of the directory, so entries
+    for any others can go. Return the list of instructions.
+    """
+    options = (comments, optimize, shared_cmp)
+    keys = [vm_cache.cache_key(fn, options) for fn in files]
+    results = [vm_cache.load(cache_dir, key) for key in keys]
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    worker = partial(translate_separately, comments=comments, optimize=optimize,
+                     shared_cmp=shared_cmp)
+    if parallel and len(missing) > 1:
+        with ProcessPoolExecutor() as pool:
+            translated = list(pool.map(worker, [files[i] for i in missing]))
+    else:
+        translated = [worker(files[i]) for i in missing]
+
+    for i, result in zip(missing, translated):
+        vm_cache.store(cache_dir, keys[i], *result)
+        results[i] = result
+    vm_cache.prune(cache_dir, keys, complete)
+
+    return link(results, bootstrap, shared_cmp)
+
+
+def link(results, bootstrap=False, shared_cmp=False):
+    """Stitch the (instructions, stubs) of separately translated files
+    together in order, after the bootstrapping code if needed, and add the
+    stubs they use. Return the list of instructions.
+    """
+    ctx = translations.Context(inline_stubs=False, shared_cmp=shared_cmp)
+    asm = translations.bootstrap(ctx) if bootstrap else []
+    stubs = ctx.stubs
+    for file_asm, file_stubs in results:
+        asm.extend(file_asm)
+        stubs.update(file_stubs)
+    asm.extend(translations.link_stubs(stubs))
+
+    return asm
+
+
+def translate_program(filepath, comments=True, optimize=False, size=False, parallel=False,
+                      cache=False):
+    """Translate a .vm file, or the .vm files of a directory, with the
+    options set by FLAGS. Return the output path, the module name and the
+    list of instructions.
+    """
+    path, module, files, bootstrap = find_files(filepath)
+    if cache:
+        asm = translate_cached(files, op.join(path, vm_cache.CACHE_DIR), bootstrap,
+                               comments=comments, optimize=optimize, shared_cmp=size,
+                               parallel=parallel, complete=op.isdir(filepath))
+    elif parallel:
+        asm = translate_parallel(files, bootstrap, comments=comments, optimize=optimize,
+                                 shared_cmp=size)
+    else:
+        asm = translate(files, bootstrap, comments=comments, optimize=optimize,
+                        shared_cmp=size)
+    if optimize:
+        asm = peephole.optimize(asm)
+
+    return path, module, list(asm)
+
+
+def main(filepath, **options):
+    path, module, asm = translate_program(filepath, **options)
 
     # Write a new asm file
     with open(op.join(path, "{}.asm".format(module)), "w") as f:
         f.write("\n".join(asm))
 
+
+def parse_flags(argv, flags=FLAGS):
+    """Return the positional arguments and a dict of the options set by
+    flags (see FLAGS).
+    """
+    args = []
+    options = {}
+    for arg in argv:
+        if arg in flags:
+            options.update(flags[arg])
+        else:
+            args.append(arg)
+
+    return args, options
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: {} <vm file or path>".format(sys.argv[0]))
+    args, options = parse_flags(sys.argv[1:])
+    if len(args) != 1:
+        print("Usage: {} [{}] <vm file or path>".format(sys.argv[0], "] [".join(FLAGS)))
         sys.exit(1)
 
-    main(sys.argv[1])
+    main(args[0], **options)
@@ -0,0 +1,86 @@
+"""Peephole optimizer over translated hack assembly.
+
+The helpers in translations.py are concatenated without looking at their
+neighbours, so consecutive VM commands often push a value only to pop it
+straight back. This pass looks at the tail of the output as each
+instruction arrives and collapses those round-trips, even across command
+boundaries. Comments are skipped when matching and kept in the output.
+"""
+import translations
+
+PUSH_D = translations.push_d()
+POP_D = translations.pop_d()
+STACK_TOP = translations.get_stack_top_addr()
+
+# push_d followed by pop_d leaves D and SP unchanged. Only A differs, so the
+# pair can only go if the next instruction sets A.
+PUSH_POP = PUSH_D + POP_D
+# push_d leaves A pointing at the top of the stack already.
+PUSH_STACK_TOP = PUSH_D + STACK_TOP[:-1]
+# pop_d followed by push_d only reads the top of the stack.
+POP_PUSH = POP_D + PUSH_D[:-1]
+PEEK_D = [
+    "@SP",
+    "A=M-1",
+    "D=M",
+]
+
+
+def is_comment(insn):
+    return insn.startswith("//")
+
+
+def match_tail(out, pattern):
+    """Return the indices in out of the trailing instructions matching
+    pattern, skipping comments, last first. Return None if they don't match.
+    """
+    indices = []
+    i = len(out)
+    for expected in reversed(pattern):
+        i -= 1
+        while i >= 0 and is_comment(out[i]):
+            i -= 1
+        if i < 0 or out[i] != expected:
+            return None
+        indices.append(i)
+
+    return indices
+
+
+def delete(out, indices):
+    """Delete the instructions at indices (last first) from out."""
+    for i in indices:
+        del out[i]
+
+
+def optimize(instructions):
+    """Take an iterable of assembly instructions and return an optimized
+    list of instructions.
+    """
+    out = []
+    for insn in instructions:
+        if is_comment(insn):
+            pass
+        elif insn[0] == "@":
+            match = match_tail(out, PUSH_POP)
+            if match:
+                delete(out, match)
+        elif insn == STACK_TOP[-1]:
+            match = match_tail(out, PUSH_STACK_TOP)
+            if match:
+                delete(out, match[:len(STACK_TOP) - 1])
+                continue
+            match = match_tail(out, ["A=M"])
+            if match:
+                out[match[0]] = "A=M-1"
+                continue
+        elif insn == PUSH_D[-1]:
+            match = match_tail(out, POP_PUSH)
+            if match:
+                delete(out, match)
+                out.extend(PEEK_D)
+                continue
+
+        out.append(insn)
+
+    return out
@@ -1,3 +1,5 @@
+from functools import partial
+
 SEGMENT_MAP = {
     "argument": "ARG",
     "local": "LCL",
@@ -6,6 +8,9 @@ SEGMENT_MAP = {
 }
 CALL_LABEL = "CALL"
 RETURN_LABEL = "RETURN"
+CMP_LABEL = "CMP_{}"
+# Largest offset reached with an A=M+1, A=A+1... chain rather than an add
+SMALL_OFFSET_MAX = 2
 # Used for push
 PUSH_TEMP_REG = "R13"
 # Used for call
@@ -14,15 +19,32 @@ FUNC_ADDR_REG = "R15"
 # Used for return
 END_FRAME_REG = "R14"
 RA_REG = "R15"
+# Used for comparisons
+CMP_RA_REG = "R15"
+
 
-filename = ""
-count = 0
-current_function = ""
-return_inserted = False
-call_inserted = False
+class Context():
+    """Translation state of a program, passed to every translation function
+    that needs it.
+
+    filename, count and current_function describe the file being translated.
+    stubs holds the labels of the shared stubs (call, return, comparisons)
+    inserted so far. Files translated in separate contexts, e.g. in parallel,
+    can't know whether another file inserted a stub: with inline_stubs off,
+    stubs are only ever jumped to and recorded, and link_stubs() adds them
+    once all files are translated.
+    """
+    def __init__(self, filename="", inline_stubs=True, shared_cmp=False):
+        self.filename = filename
+        self.count = 0
+        self.current_function = ""
+        self.inline_stubs = inline_stubs
+        # Optimize comparisons for size by sharing a routine per kind
+        self.shared_cmp = shared_cmp
+        self.stubs = set()
 
 
-def bootstrap():
+def bootstrap(ctx):
     """Boilerplate bootstrapping code.
     """
     return [
@@ -30,26 +52,32 @@ def bootstrap():
         "D=A",
         "@SP",
         "M=D",
-        *insert_call("Sys.init", 0)
+        *insert_call(ctx, "Sys.init", 0)
     ]
 
 
-def push_command(command):
-    if command.arg1 == "constant":
-        return push_constant(command.arg2)
-
+def push_command(ctx, command):
     return [
-        *get_addr(command.arg1, command.arg2),
-        "D=M",
+        *load_d(ctx, command.arg1, command.arg2),
         *push_d(),
     ]
 
 
-def pop_command(command):
+def pop_command(ctx, command):
+    addr = get_addr_a(ctx, command.arg1, command.arg2)
+    if addr is not None:
+        return [
+            # Pop value into D
+            *pop_d(),
+            # Write D into address
+            *addr,
+            "M=D",
+        ]
+
     return [
         # Get target address
         # -- Get address
-        *get_addr(command.arg1, command.arg2),
+        *get_addr(ctx, command.arg1, command.arg2),
         # -- Write it to register
         "@{}".format(PUSH_TEMP_REG),
         "M=D",
@@ -62,7 +90,41 @@ def pop_command(command):
     ]
 
 
-def arith_command(op, _):
+def move_command(ctx, command):
+    """Copy a value from one segment to another without going through the
+    stack. arg1 and arg2 are the (segment, offset) source and destination.
+    """
+    addr = get_addr_a(ctx, *command.arg2)
+    if addr is not None:
+        return [
+            *load_d(ctx, *command.arg1),
+            *addr,
+            "M=D",
+        ]
+
+    return [
+        # Get target address
+        *get_addr(ctx, *command.arg2),
+        "@{}".format(PUSH_TEMP_REG),
+        "M=D",
+        # Read the value into D
+        *load_d(ctx, *command.arg1),
+        # Write D into address
+        "@{}".format(PUSH_TEMP_REG),
+        "A=M",
+        "M=D",
+    ]
+
+
+def drop_command(ctx, _):
+    """Discard the top of the stack."""
+    return [
+        "@SP",
+        "M=M-1",
+    ]
+
+
+def arith_command(op, ctx, _):
     return [
         # Pop second argument
         *pop_d(),
@@ -72,16 +134,19 @@ def arith_command(op, _):
     ]
 
 
-def neg_command(_):
+def neg_command(ctx, _):
     return [
         *get_stack_top_addr(),
         "M=-M",
     ]
 
 
-def cmp_command(comparison, command):
-    true_label = label("{}_TRUE_{}".format(comparison, count))
-    end_label = label("{}_END_{}".format(comparison, count))
+def cmp_command(comparison, ctx, command):
+    if ctx.shared_cmp:
+        return insert_cmp(ctx, comparison)
+
+    true_label = label(ctx, "{}_TRUE_{}".format(comparison, ctx.count))
+    end_label = label(ctx, "{}_END_{}".format(comparison, ctx.count))
     return [
         *pop_d(),  # Read second arg
         *get_stack_top_addr(), # Addr of first arg
@@ -99,41 +164,78 @@ def cmp_command(comparison, command):
     ]
 
 
-def not_command(_):
+def insert_cmp(ctx, comparison):
+    """Jump to the shared comparison routine, inserting it if it hasn't
+    been yet.
+    """
+    return_label = label(ctx, "{}_RET_{}".format(comparison, ctx.count))
+    ins = [
+        # Put the RA into D
+        "@{}".format(return_label),
+        "D=A",
+        *use_stub(ctx, CMP_LABEL.format(comparison)),
+    ]
+
+    ins.extend(add_label(return_label))
+
+    return ins
+
+
+def cmp_stub(comparison):
+    """Compare the two values on top of the stack, replace them by the
+    result and jump back to the return address, which was put into D.
+    """
+    return [
+        *add_label(CMP_LABEL.format(comparison)),
+        *write_d_into_addr(CMP_RA_REG),
+        *pop_d(),  # Read second arg
+        "A=A-1",  # Addr of first arg
+        "D=M-D",  # cmp
+        "M=-1",  # Assume true
+        *deref_pointer_a(CMP_RA_REG),
+        "D;J{}".format(comparison),  # If true, we're done
+        *get_stack_top_addr(),  # Otherwise, set it to 0
+        "M=0",
+        *deref_pointer_a(CMP_RA_REG),
+        "0;JMP",
+    ]
+
+
+def not_command(ctx, _):
     return [
         *get_stack_top_addr(),
         "M=!M",
     ]
 
 
-def goto_command(command):
+def goto_command(ctx, command):
     return [
-        *jmp_address(label(command.arg1)),
+        *jmp_address(label(ctx, command.arg1)),
     ]
 
 
-def if_goto_command(command):
+def if_goto_command(ctx, command):
     return [
         *pop_d(),
-        "@{}".format(label(command.arg1)),
+        "@{}".format(label(ctx, command.arg1)),
         "D;JNE",
     ]
 
 
-def label_command(command):
+def label_command(ctx, command):
     return [
-        *add_label(label(command.arg1)),
+        *add_label(label(ctx, command.arg1)),
     ]
 
 
-def call_command(command):
+def call_command(ctx, command):
     func = command.arg1
     num_args = int(command.arg2)
-    return insert_call(func, num_args)
+    return insert_call(ctx, func, num_args)
 
 
-def insert_call(func, num_args):
-    return_label = "{}$ret.{}".format(current_function, count)
+def insert_call(ctx, func, num_args):
+    return_label = "{}$ret.{}".format(ctx.current_function, ctx.count)
     ins = [
         # Save target address
         "@{}".format(func),
@@ -148,11 +250,8 @@ def insert_call(func, num_args):
         # Put the RA into D
         "@{}".format(return_label),
         "D=A",
+        *use_stub(ctx, CALL_LABEL),
     ]
-    if call_inserted:
-        ins.extend(["@{}".format(CALL_LABEL), "0;JMP"])
-    else:
-        ins.extend(call_stub())
 
     ins.extend(add_label(return_label))
 
@@ -161,8 +260,6 @@ def insert_call(func, num_args):
 
 def call_stub():
     """Set up the stack and jump to the function saved in a temp register."""
-    global call_inserted
-    call_inserted = True
     return [
         *add_label(CALL_LABEL),
         # Save old state
@@ -195,10 +292,9 @@ def call_stub():
     ]
 
 
-def function_command(command):
-    global current_function
+def function_command(ctx, command):
     name = command.arg1
-    current_function = name
+    ctx.current_function = name
     num_locals = int(command.arg2)
     return [
         *add_label(name),
@@ -207,15 +303,33 @@ def function_command(command):
     ]
 
 
-def return_command(_):
+def return_command(ctx, _):
     """Jump to a return stub. If it hasn't been insterted yet, then insert it."""
-    if not return_inserted:
-        return return_stub()
-    else:
-        return [
-            "@{}".format(RETURN_LABEL),
-            "0;JMP",
-        ]
+    return use_stub(ctx, RETURN_LABEL)
+
+
+def use_stub(ctx, name):
+    """Jump to the named stub. If stubs are inlined and it hasn't been
+    inserted yet, then insert it instead.
+    """
+    if ctx.inline_stubs and name not in ctx.stubs:
+        ctx.stubs.add(name)
+        return STUBS[name]()
+
+    ctx.stubs.add(name)
+    return jmp_address(name)
+
+
+def link_stubs(names):
+    """Return the code for the named stubs, in a fixed order. Used when
+    files were translated without inlining stubs.
+    """
+    ins = []
+    for name, stub in STUBS.items():
+        if name in names:
+            ins.extend(stub())
+
+    return ins
 
 
 def jmp_address(addr):
@@ -236,31 +350,70 @@ def jmp_d():
     ]
 
 
-def get_addr(segment, offset):
+def get_addr(ctx, segment, offset):
     """Set A & D to the address specified by the segment and offset provided.
     """
-    ins = []
-    # Get target address
-    # -- Get base
-    if segment in SEGMENT_MAP:
-        segment = SEGMENT_MAP[segment]
-        ins.extend(deref_pointer_d(segment))
-    else:
-        if segment == "pointer":
-            ins.append("@3")
-        elif segment == "temp":
-            ins.append("@5")
-        elif segment == "static":
-            ins.append("@{}.{}".format(filename, offset))
-            offset = None
+    addr = direct_addr(ctx, segment, offset)
+    if addr is not None:
+        return [
+            "@{}".format(addr),
+            "D=A",
+        ]
 
-        ins.append("D=A")
+    return [
+        *deref_pointer_d(SEGMENT_MAP[segment]),
+        "@{}".format(offset),
+        "AD=D+A",
+    ]
 
-    if offset:
-        ins.append("@{}".format(offset))
-        ins.append("AD=D+A")
 
-    return ins
+def get_addr_a(ctx, segment, offset):
+    """Set A to the address specified by the segment and offset provided,
+    leaving D alone. Only possible for segments at fixed addresses and small
+    offsets into the others: return None otherwise.
+    """
+    addr = direct_addr(ctx, segment, offset)
+    if addr is not None:
+        return ["@{}".format(addr)]
+
+    offset = int(offset)
+    if offset > SMALL_OFFSET_MAX:
+        return None
+
+    return [
+        "@{}".format(SEGMENT_MAP[segment]),
+        "A=M" if offset == 0 else "A=M+1",
+        *(["A=A+1"] * (offset - 1)),
+    ]
+
+
+def direct_addr(ctx, segment, offset):
+    """Return the fixed address (or static symbol) of the segment and
+    offset, or None if the segment is relative to a pointer.
+    """
+    if segment == "pointer":
+        return 3 + int(offset)
+    elif segment == "temp":
+        return 5 + int(offset)
+    elif segment == "static":
+        return "{}.{}".format(ctx.filename, offset)
+    return None
+
+
+def load_d(ctx, segment, offset):
+    """Set D to the value in the segment at the offset provided.
+    """
+    if segment == "constant":
+        return constant_d(offset)
+
+    addr = get_addr_a(ctx, segment, offset)
+    if addr is None:
+        addr = get_addr(ctx, segment, offset)
+
+    return [
+        *addr,
+        "D=M",
+    ]
 
 
 def get_pointer_offset(ptr, offset):
@@ -375,12 +528,31 @@ def push_a():
     ]
 
 
+def constant_d(value):
+    """Set D to a constant. Negative constants don't appear in VM code but
+    are produced by the VM optimizer.
+    """
+    value = int(value)
+    if value == -1:
+        return ["D=-1"]
+    elif value < 0:
+        return [
+            "@{}".format(-value),
+            "D=-A",
+        ]
+
+    return [
+        "@{}".format(value),
+        "D=A",
+    ]
+
+
 def push_constant(value):
     """Push value onto stack.
     """
     return [
-        "@{}".format(value),
-        *push_a(),
+        *constant_d(value),
+        *push_d(),
     ]
 
 
@@ -399,16 +571,13 @@ def add_label(name):
     return ["({})".format(name)]
 
 
-def label(label):
+def label(ctx, label):
     """Make a label unique to the function where it appears.
     """
-    return "{}${}".format(current_function, label)
+    return "{}${}".format(ctx.current_function, label)
 
 
 def return_stub():
-    global return_inserted
-    return_inserted = True
-
     return [
         *add_label(RETURN_LABEL),
         # End frame = LCL
@@ -450,3 +619,12 @@ def return_stub():
         "A=M",
         "0;JMP",
     ]
+
+
+STUBS = {
+    CALL_LABEL: call_stub,
+    RETURN_LABEL: return_stub,
+    CMP_LABEL.format("EQ"): partial(cmp_stub, "EQ"),
+    CMP_LABEL.format("GT"): partial(cmp_stub, "GT"),
+    CMP_LABEL.format("LT"): partial(cmp_stub, "LT"),
+}
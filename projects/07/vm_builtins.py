@@ -0,0 +1,769 @@
+"""Native implementations of OS functions for the VM emulator.
+
+Each is a port of the function of the same name in the OS supplied in
+tools/OS, down to its quirks: comparisons on 16-bit differences, the heap
+layout, the statics, the screen, and the values its array assignments and
+do statements leave in temp 0. Ports call each other directly.
+
+A builtin takes the VM and the function's arguments as signed values, and
+returns the function's return value. Sys.halt, and so Sys.error, raise Halt.
+The VM only binds them when the loaded OS is the supplied one. Objects are
+expected on the heap: the VM code's own registers and stack frames aren't
+modelled, so objects overlapping them behave differently.
+"""
+import glob
+import os.path as op
+
+import VMTranslator
+from vm_optimizer import to_signed
+
+OS_DIR = op.join(op.dirname(op.abspath(__file__)), "..", "..", "tools", "OS")
+TRUE = -1
+TEMP_0 = 5
+# More links than this in the free list means it loops, and alloc hangs
+MAX_FREE_BLOCKS = 0x8000
+
+# The statics of the OS
+MATH_TWO_TO_THE = "Math.0"
+MATH_DIVISORS = "Math.1"
+MEMORY_BASE = "Memory.0"
+SCREEN_TWO_TO_THE = "Screen.0"
+SCREEN_BASE = "Screen.1"
+SCREEN_COLOR = "Screen.2"
+OUTPUT_COLUMN = "Output.0"
+OUTPUT_ADDRESS = "Output.1"
+OUTPUT_LEFT_HALF = "Output.2"
+OUTPUT_INT_STRING = "Output.3"
+OUTPUT_SCREEN = "Output.4"
+OUTPUT_MAPS = "Output.5"
+OUTPUT_SHIFTED_MAPS = "Output.6"
+# Fields of String objects
+STRING_MAX_LENGTH = 0
+STRING_CHARS = 1
+STRING_LENGTH = 2
+
+_os_functions = None
+
+
+class Halt(Exception):
+    """Raised when the OS halts."""
+
+
+def lt(x, y):
+    return to_signed(x - y) < 0
+
+
+def gt(x, y):
+    return to_signed(x - y) > 0
+
+
+def eq(x, y):
+    return to_signed(x - y) == 0
+
+
+def flag(value):
+    return TRUE if value else 0
+
+
+def peek(vm, addr):
+    return to_signed(vm.ram[addr & 0xFFFF])
+
+
+def poke(vm, addr, value):
+    vm.ram[addr & 0xFFFF] = value & 0xFFFF
+
+
+def store(vm, addr, value):
+    """An array assignment, which goes through temp 0."""
+    poke(vm, TEMP_0, value)
+    poke(vm, addr, value)
+
+
+def discard(vm, value):
+    """The return value of a do statement, popped into temp 0."""
+    poke(vm, TEMP_0, value)
+
+
+def static(vm, name):
+    return peek(vm, vm.statics[name])
+
+
+def set_static(vm, name, value):
+    poke(vm, vm.statics[name], value)
+
+
+def field(vm, this, index):
+    return peek(vm, this + index)
+
+
+def set_field(vm, this, index, value):
+    poke(vm, this + index, value)
+
+
+# Math
+
+def math_abs(vm, x):
+    return to_signed(-x) if x < 0 else x
+
+
+def math_multiply(vm, x, y):
+    negative = (x < 0 and y > 0) or (x > 0 and y < 0)
+    x = math_abs(vm, x)
+    y = math_abs(vm, y)
+    if lt(x, y):
+        x, y = y, x
+
+    two_to_the = static(vm, MATH_TWO_TO_THE)
+    product = 0
+    done = 0
+    bit = 0
+    while lt(done - 1, y - 1):
+        mask = peek(vm, bit + two_to_the)
+        if mask & y:
+            product = to_signed(product + x)
+            done = to_signed(done + mask)
+        x = to_signed(x + x)
+        bit += 1
+
+    return to_signed(-product) if negative else product
+
+
+def math_divide(vm, x, y):
+    if y == 0:
+        sys_error(vm, 3)
+    negative = (x < 0 and y > 0) or (x > 0 and y < 0)
+    divisors = static(vm, MATH_DIVISORS)
+    # Shifted copies of the divisor, for as long as they fit
+    store(vm, divisors, math_abs(vm, y))
+    x = math_abs(vm, x)
+    i = 0
+    overflow = False
+    while i < 15 and not overflow:
+        divisor = peek(vm, i + divisors)
+        overflow = lt(32767 - (divisor - 1), divisor - 1)
+        if not overflow:
+            store(vm, i + 1 + divisors, divisor + divisor)
+            overflow = gt(peek(vm, i + 1 + divisors) - 1, x - 1)
+            if not overflow:
+                i += 1
+
+    two_to_the = static(vm, MATH_TWO_TO_THE)
+    quotient = 0
+    while i > -1:
+        divisor = peek(vm, i + divisors)
+        if not gt(divisor - 1, x - 1):
+            quotient = to_signed(quotient + peek(vm, i + two_to_the))
+            x = to_signed(x - divisor)
+        i -= 1
+
+    return to_signed(-quotient) if negative else quotient
+
+
+def math_sqrt(vm, x):
+    if x < 0:
+        sys_error(vm, 4)
+    two_to_the = static(vm, MATH_TWO_TO_THE)
+    y = 0
+    for bit in range(7, -1, -1):
+        guess = to_signed(y + peek(vm, bit + two_to_the))
+        square = math_multiply(vm, guess, guess)
+        if not gt(square, x) and not lt(square, 0):
+            y = guess
+
+    return y
+
+
+def math_max(vm, x, y):
+    return x if gt(x, y) else y
+
+
+def math_min(vm, x, y):
+    return x if lt(x, y) else y
+
+
+# Memory
+
+def memory_peek(vm, addr):
+    return peek(vm, addr + static(vm, MEMORY_BASE))
+
+
+def memory_poke(vm, addr, value):
+    store(vm, addr + static(vm, MEMORY_BASE), value)
+    return 0
+
+
+def memory_alloc(vm, size):
+    if lt(size, 1):
+        sys_error(vm, 5)
+    # First fit
+    block = 2048
+    for _ in range(MAX_FREE_BLOCKS):
+        if not lt(peek(vm, block), size):
+            break
+        block = peek(vm, block + 1)
+    else:
+        raise Halt()
+    if gt(block + size, 16379):
+        sys_error(vm, 6)
+
+    if gt(peek(vm, block), size + 2):
+        # Split the rest off into a free block
+        store(vm, block + size + 2, peek(vm, block) - size - 2)
+        if eq(peek(vm, block + 1), block + 2):
+            store(vm, block + size + 3, block + size + 4)
+        else:
+            store(vm, block + size + 3, peek(vm, block + 1))
+        store(vm, block + 1, block + size + 2)
+    store(vm, block, 0)
+
+    return to_signed(block + 2)
+
+
+def memory_dealloc(vm, obj):
+    block = obj - 2
+    following = peek(vm, block + 1)
+    if eq(peek(vm, following), 0):
+        store(vm, block, peek(vm, block + 1) - block - 2)
+    else:
+        # Merge with the following free block
+        store(vm, block, peek(vm, block + 1) - block + peek(vm, following))
+        if eq(peek(vm, following + 1), following + 2):
+            store(vm, block + 1, block + 2)
+        else:
+            store(vm, block + 1, peek(vm, following + 1))
+
+    return 0
+
+
+# Array
+
+def array_new(vm, size):
+    if not gt(size, 0):
+        sys_error(vm, 2)
+    return memory_alloc(vm, size)
+
+
+def array_dispose(vm, this):
+    discard(vm, memory_dealloc(vm, this))
+    return 0
+
+
+# String
+
+def string_new(vm, max_length):
+    this = memory_alloc(vm, 3)
+    if lt(max_length, 0):
+        sys_error(vm, 14)
+    if gt(max_length, 0):
+        set_field(vm, this, STRING_CHARS, array_new(vm, max_length))
+    set_field(vm, this, STRING_MAX_LENGTH, max_length)
+    set_field(vm, this, STRING_LENGTH, 0)
+
+    return this
+
+
+def string_dispose(vm, this):
+    if gt(field(vm, this, STRING_MAX_LENGTH), 0):
+        discard(vm, array_dispose(vm, field(vm, this, STRING_CHARS)))
+    discard(vm, memory_dealloc(vm, this))
+    return 0
+
+
+def string_length(vm, this):
+    return field(vm, this, STRING_LENGTH)
+
+
+def check_index(vm, this, j, error):
+    length = field(vm, this, STRING_LENGTH)
+    if lt(j, 0) or gt(j, length) or eq(j, length):
+        sys_error(vm, error)
+
+
+def string_char_at(vm, this, j):
+    check_index(vm, this, j, 15)
+    return peek(vm, j + field(vm, this, STRING_CHARS))
+
+
+def string_set_char_at(vm, this, j, c):
+    check_index(vm, this, j, 16)
+    store(vm, j + field(vm, this, STRING_CHARS), c)
+    return 0
+
+
+def string_append_char(vm, this, c):
+    length = field(vm, this, STRING_LENGTH)
+    if eq(length, field(vm, this, STRING_MAX_LENGTH)):
+        sys_error(vm, 17)
+    store(vm, length + field(vm, this, STRING_CHARS), c)
+    set_field(vm, this, STRING_LENGTH, length + 1)
+
+    return this
+
+
+def string_erase_last_char(vm, this):
+    length = field(vm, this, STRING_LENGTH)
+    if eq(length, 0):
+        sys_error(vm, 18)
+    set_field(vm, this, STRING_LENGTH, length - 1)
+
+    return 0
+
+
+def string_int_value(vm, this):
+    length = field(vm, this, STRING_LENGTH)
+    if eq(length, 0):
+        return 0
+    chars = field(vm, this, STRING_CHARS)
+    i = 0
+    negative = eq(peek(vm, chars), ord("-"))
+    if negative:
+        i = 1
+
+    value = 0
+    digit_found = True
+    while lt(i, length) and digit_found:
+        digit = to_signed(peek(vm, i + chars) - ord("0"))
+        digit_found = not (lt(digit, 0) or gt(digit, 9))
+        if digit_found:
+            value = to_signed(math_multiply(vm, value, 10) + digit)
+            i += 1
+
+    return to_signed(-value) if negative else value
+
+
+def string_set_int(vm, this, n):
+    if eq(field(vm, this, STRING_MAX_LENGTH), 0):
+        sys_error(vm, 19)
+    # Digits, last first
+    digits = array_new(vm, 6)
+    negative = lt(n, 0)
+    if negative:
+        n = to_signed(-n)
+
+    count = 0
+    quotient = n
+    while gt(quotient, 0):
+        quotient = math_divide(vm, n, 10)
+        store(vm, count + digits, ord("0") + n - math_multiply(vm, quotient, 10))
+        count += 1
+        n = quotient
+    if negative:
+        store(vm, count + digits, ord("-"))
+        count += 1
+    if lt(field(vm, this, STRING_MAX_LENGTH), count):
+        sys_error(vm, 19)
+
+    chars = field(vm, this, STRING_CHARS)
+    if eq(count, 0):
+        store(vm, chars, ord("0"))
+        set_field(vm, this, STRING_LENGTH, 1)
+    else:
+        set_field(vm, this, STRING_LENGTH, 0)
+        while lt(field(vm, this, STRING_LENGTH), count):
+            length = field(vm, this, STRING_LENGTH)
+            store(vm, length + field(vm, this, STRING_CHARS),
+                  peek(vm, count - (length + 1) + digits))
+            set_field(vm, this, STRING_LENGTH, length + 1)
+    discard(vm, array_dispose(vm, digits))
+
+    return 0
+
+
+def string_new_line(vm):
+    return 128
+
+
+def string_back_space(vm):
+    return 129
+
+
+def string_double_quote(vm):
+    return 34
+
+
+# Screen
+
+def screen_clear_screen(vm):
+    base = static(vm, SCREEN_BASE)
+    for i in range(8192):
+        store(vm, i + base, 0)
+
+    return 0
+
+
+def screen_update_location(vm, addr, mask):
+    addr += static(vm, SCREEN_BASE)
+    if static(vm, SCREEN_COLOR):
+        store(vm, addr, peek(vm, addr) | mask)
+    else:
+        store(vm, addr, peek(vm, addr) & ~mask)
+
+    return 0
+
+
+def screen_set_color(vm, color):
+    set_static(vm, SCREEN_COLOR, color)
+    return 0
+
+
+def screen_draw_pixel(vm, x, y):
+    if lt(x, 0) or gt(x, 511) or lt(y, 0) or gt(y, 255):
+        sys_error(vm, 7)
+    word = math_divide(vm, x, 16)
+    bit = x - math_multiply(vm, word, 16)
+    addr = math_multiply(vm, y, 32) + word
+    discard(vm, screen_update_location(
+        vm, addr, peek(vm, bit + static(vm, SCREEN_TWO_TO_THE))))
+
+    return 0
+
+
+def screen_draw_conditional(vm, x, y, swapped):
+    if swapped:
+        discard(vm, screen_draw_pixel(vm, y, x))
+    else:
+        discard(vm, screen_draw_pixel(vm, x, y))
+
+    return 0
+
+
+def screen_draw_line(vm, x1, y1, x2, y2):
+    if lt(x1, 0) or gt(x2, 511) or lt(y1, 0) or gt(y2, 255):
+        sys_error(vm, 8)
+    dx = math_abs(vm, to_signed(x2 - x1))
+    dy = math_abs(vm, to_signed(y2 - y1))
+    # Step along the longer axis, from its lower end
+    steep = lt(dx, dy)
+    if (steep and lt(y2, y1)) or (not steep and lt(x2, x1)):
+        x1, x2 = x2, x1
+        y1, y2 = y2, y1
+    if steep:
+        dx, dy = dy, dx
+        a, b, end = y1, x1, y2
+        decreasing = gt(x1, x2)
+    else:
+        a, b, end = x1, y1, x2
+        decreasing = gt(y1, y2)
+
+    error = to_signed(math_multiply(vm, 2, dy) - dx)
+    straight = math_multiply(vm, 2, dy)
+    diagonal = math_multiply(vm, 2, to_signed(dy - dx))
+    discard(vm, screen_draw_conditional(vm, a, b, steep))
+    while lt(a, end):
+        if lt(error, 0):
+            error = to_signed(error + straight)
+        else:
+            error = to_signed(error + diagonal)
+            b = to_signed(b - 1 if decreasing else b + 1)
+        a = to_signed(a + 1)
+        discard(vm, screen_draw_conditional(vm, a, b, steep))
+
+    return 0
+
+
+def fill_words(vm, addr, words, first_mask, last_mask):
+    """Fill a row from the first_mask bits of the word at addr to the
+    last_mask bits of the word words further on. Return the address of the
+    last word.
+    """
+    last = to_signed(addr + words)
+    if eq(words, 0):
+        discard(vm, screen_update_location(vm, addr, last_mask & first_mask))
+    else:
+        discard(vm, screen_update_location(vm, addr, first_mask))
+        addr = to_signed(addr + 1)
+        while lt(addr, last):
+            discard(vm, screen_update_location(vm, addr, TRUE))
+            addr = to_signed(addr + 1)
+        discard(vm, screen_update_location(vm, last, last_mask))
+
+    return last
+
+
+def row_masks(vm, x1, x2):
+    """Return the words of x1 and x2 and the masks of the bits from x1 and
+    up to x2 in them.
+    """
+    two_to_the = static(vm, SCREEN_TWO_TO_THE)
+    first = math_divide(vm, x1, 16)
+    first_bit = x1 - math_multiply(vm, first, 16)
+    last = math_divide(vm, x2, 16)
+    last_bit = x2 - math_multiply(vm, last, 16)
+    first_mask = ~to_signed(peek(vm, first_bit + two_to_the) - 1)
+    last_mask = to_signed(peek(vm, last_bit + 1 + two_to_the) - 1)
+
+    return first, last, first_mask, last_mask
+
+
+def screen_draw_rectangle(vm, x1, y1, x2, y2):
+    if (gt(x1, x2) or gt(y1, y2) or lt(x1, 0) or gt(x2, 511)
+            or lt(y1, 0) or gt(y2, 255)):
+        sys_error(vm, 9)
+    first, last, first_mask, last_mask = row_masks(vm, x1, x2)
+    addr = to_signed(math_multiply(vm, y1, 32) + first)
+    words = to_signed(last - first)
+    while not gt(y1, y2):
+        end = fill_words(vm, addr, words, first_mask, last_mask)
+        y1 = to_signed(y1 + 1)
+        addr = to_signed(end + 32 - words)
+
+    return 0
+
+
+def screen_draw_horizontal(vm, y, x1, x2):
+    left = math_min(vm, x1, x2)
+    right = math_max(vm, x1, x2)
+    if gt(y, -1) and lt(y, 256) and lt(left, 512) and gt(right, -1):
+        left = math_max(vm, left, 0)
+        right = math_min(vm, right, 511)
+        first, last, first_mask, last_mask = row_masks(vm, left, right)
+        addr = to_signed(math_multiply(vm, y, 32) + first)
+        fill_words(vm, addr, to_signed(last - first), first_mask, last_mask)
+
+    return 0
+
+
+def screen_draw_symetric(vm, x, y, dx, dy):
+    discard(vm, screen_draw_horizontal(vm, to_signed(y - dy), to_signed(x + dx), to_signed(x - dx)))
+    discard(vm, screen_draw_horizontal(vm, to_signed(y + dy), to_signed(x + dx), to_signed(x - dx)))
+    discard(vm, screen_draw_horizontal(vm, to_signed(y - dx), to_signed(x - dy), to_signed(x + dy)))
+    discard(vm, screen_draw_horizontal(vm, to_signed(y + dx), to_signed(x - dy), to_signed(x + dy)))
+    return 0
+
+
+def screen_draw_circle(vm, x, y, r):
+    if lt(x, 0) or gt(x, 511) or lt(y, 0) or gt(y, 255):
+        sys_error(vm, 12)
+    if lt(x - r, 0) or gt(x + r, 511) or lt(y - r, 0) or gt(y + r, 255):
+        sys_error(vm, 13)
+    dx = 0
+    dy = r
+    error = to_signed(1 - r)
+    discard(vm, screen_draw_symetric(vm, x, y, dx, dy))
+    while gt(dy, dx):
+        if lt(error, 0):
+            error = to_signed(error + math_multiply(vm, 2, dx) + 3)
+        else:
+            error = to_signed(error + math_multiply(vm, 2, to_signed(dx - dy)) + 5)
+            dy = to_signed(dy - 1)
+        dx = to_signed(dx + 1)
+        discard(vm, screen_draw_symetric(vm, x, y, dx, dy))
+
+    return 0
+
+
+# Output
+
+def output_get_map(vm, c):
+    if lt(c, 32) or gt(c, 126):
+        c = 0
+    if static(vm, OUTPUT_LEFT_HALF):
+        return peek(vm, c + static(vm, OUTPUT_MAPS))
+    return peek(vm, c + static(vm, OUTPUT_SHIFTED_MAPS))
+
+
+def output_draw_char(vm, c):
+    glyph = output_get_map(vm, c)
+    addr = static(vm, OUTPUT_ADDRESS)
+    screen = static(vm, OUTPUT_SCREEN)
+    for row in range(11):
+        # Keep the other character sharing the word
+        if static(vm, OUTPUT_LEFT_HALF):
+            kept = peek(vm, addr + screen) & -256
+        else:
+            kept = peek(vm, addr + screen) & 255
+        store(vm, addr + screen, peek(vm, row + glyph) | kept)
+        addr = to_signed(addr + 32)
+
+    return 0
+
+
+def output_move_cursor(vm, i, j):
+    if lt(i, 0) or gt(i, 22) or lt(j, 0) or gt(j, 63):
+        sys_error(vm, 20)
+    set_static(vm, OUTPUT_COLUMN, math_divide(vm, j, 2))
+    column = static(vm, OUTPUT_COLUMN)
+    set_static(vm, OUTPUT_ADDRESS, 32 + math_multiply(vm, i, 352) + column)
+    set_static(vm, OUTPUT_LEFT_HALF, flag(eq(j, math_multiply(vm, column, 2))))
+    discard(vm, output_draw_char(vm, ord(" ")))
+
+    return 0
+
+
+def output_print_char(vm, c):
+    if eq(c, string_new_line(vm)):
+        discard(vm, output_println(vm))
+    elif eq(c, string_back_space(vm)):
+        discard(vm, output_back_space(vm))
+    else:
+        discard(vm, output_draw_char(vm, c))
+        if ~static(vm, OUTPUT_LEFT_HALF):
+            set_static(vm, OUTPUT_COLUMN, static(vm, OUTPUT_COLUMN) + 1)
+            set_static(vm, OUTPUT_ADDRESS, static(vm, OUTPUT_ADDRESS) + 1)
+        if eq(static(vm, OUTPUT_COLUMN), 32):
+            discard(vm, output_println(vm))
+        else:
+            set_static(vm, OUTPUT_LEFT_HALF, ~static(vm, OUTPUT_LEFT_HALF))
+
+    return 0
+
+
+def output_print_string(vm, s):
+    length = string_length(vm, s)
+    i = 0
+    while lt(i, length):
+        discard(vm, output_print_char(vm, string_char_at(vm, s, i)))
+        i = to_signed(i + 1)
+
+    return 0
+
+
+def output_print_int(vm, i):
+    discard(vm, string_set_int(vm, static(vm, OUTPUT_INT_STRING), i))
+    discard(vm, output_print_string(vm, static(vm, OUTPUT_INT_STRING)))
+    return 0
+
+
+def output_println(vm):
+    set_static(vm, OUTPUT_ADDRESS,
+               static(vm, OUTPUT_ADDRESS) + 352 - static(vm, OUTPUT_COLUMN))
+    set_static(vm, OUTPUT_COLUMN, 0)
+    set_static(vm, OUTPUT_LEFT_HALF, TRUE)
+    if eq(static(vm, OUTPUT_ADDRESS), 8128):
+        set_static(vm, OUTPUT_ADDRESS, 32)
+
+    return 0
+
+
+def output_back_space(vm):
+    if static(vm, OUTPUT_LEFT_HALF):
+        if gt(static(vm, OUTPUT_COLUMN), 0):
+            set_static(vm, OUTPUT_COLUMN, static(vm, OUTPUT_COLUMN) - 1)
+            set_static(vm, OUTPUT_ADDRESS, static(vm, OUTPUT_ADDRESS) - 1)
+        else:
+            set_static(vm, OUTPUT_COLUMN, 31)
+            if eq(static(vm, OUTPUT_ADDRESS), 32):
+                set_static(vm, OUTPUT_ADDRESS, 8128)
+            set_static(vm, OUTPUT_ADDRESS, static(vm, OUTPUT_ADDRESS) - 321)
+        set_static(vm, OUTPUT_LEFT_HALF, 0)
+    else:
+        set_static(vm, OUTPUT_LEFT_HALF, TRUE)
+    discard(vm, output_draw_char(vm, ord(" ")))
+
+    return 0
+
+
+# Keyboard
+
+def keyboard_key_pressed(vm):
+    return memory_peek(vm, 24576)
+
+
+# Sys
+
+def sys_halt(vm):
+    raise Halt()
+
+
+def sys_error(vm, code):
+    message = string_new(vm, 3)
+    for c in "ERR":
+        message = string_append_char(vm, message, ord(c))
+    discard(vm, output_print_string(vm, message))
+    discard(vm, output_print_int(vm, code))
+    discard(vm, sys_halt(vm))
+
+
+def sys_wait(vm, duration):
+    if lt(duration, 0):
+        sys_error(vm, 1)
+    # Only spins, on the stack
+    return 0
+
+
+BUILTINS = {
+    "Math.abs": math_abs,
+    "Math.multiply": math_multiply,
+    "Math.divide": math_divide,
+    "Math.sqrt": math_sqrt,
+    "Math.max": math_max,
+    "Math.min": math_min,
+    "Memory.peek": memory_peek,
+    "Memory.poke": memory_poke,
+    "Memory.alloc": memory_alloc,
+    "Memory.deAlloc": memory_dealloc,
+    "Array.new": array_new,
+    "Array.dispose": array_dispose,
+    "String.new": string_new,
+    "String.dispose": string_dispose,
+    "String.length": string_length,
+    "String.charAt": string_char_at,
+    "String.setCharAt": string_set_char_at,
+    "String.appendChar": string_append_char,
+    "String.eraseLastChar": string_erase_last_char,
+    "String.intValue": string_int_value,
+    "String.setInt": string_set_int,
+    "String.newLine": string_new_line,
+    "String.backSpace": string_back_space,
+    "String.doubleQuote": string_double_quote,
+    "Screen.clearScreen": screen_clear_screen,
+    "Screen.updateLocation": screen_update_location,
+    "Screen.setColor": screen_set_color,
+    "Screen.drawPixel": screen_draw_pixel,
+    "Screen.drawConditional": screen_draw_conditional,
+    "Screen.drawLine": screen_draw_line,
+    "Screen.drawRectangle": screen_draw_rectangle,
+    "Screen.drawHorizontal": screen_draw_horizontal,
+    "Screen.drawSymetric": screen_draw_symetric,
+    "Screen.drawCircle": screen_draw_circle,
+    "Output.getMap": output_get_map,
+    "Output.drawChar": output_draw_char,
+    "Output.moveCursor": output_move_cursor,
+    "Output.printChar": output_print_char,
+    "Output.printString": output_print_string,
+    "Output.printInt": output_print_int,
+    "Output.println": output_println,
+    "Output.backSpace": output_back_space,
+    "Keyboard.keyPressed": keyboard_key_pressed,
+    "Sys.halt": sys_halt,
+    "Sys.error": sys_error,
+    "Sys.wait": sys_wait,
+}
+
+
+def function_bodies(commands):
+    """Return the lines of each function in a list of commands."""
+    bodies = {}
+    body = None
+    for command in commands:
+        if command.command == "function":
+            body = bodies[command.arg1] = []
+        if body is not None:
+            body.append(command.line)
+
+    return bodies
+
+
+def os_functions():
+    """Return the lines of each function of the supplied OS."""
+    global _os_functions
+    if _os_functions is None:
+        commands = []
+        for fn in sorted(glob.glob(op.join(OS_DIR, "*.vm"))):
+            with open(fn, "r") as f:
+                commands.extend(filter(None, map(VMTranslator.parse_line, f)))
+        _os_functions = function_bodies(commands)
+
+    return _os_functions
+
+
+def bind(commands):
+    """Return the builtins to use in place of the functions in a list of
+    commands: all of them if it includes the supplied OS unchanged, else none.
+    """
+    bodies = function_bodies(commands)
+    for name, body in os_functions().items():
+        if bodies.get(name) != body:
+            return {}
+
+    return dict(BUILTINS)
@@ -0,0 +1,96 @@
+"""On-disk cache of separately translated .vm files.
+
+Entries hold a file's instructions and the stubs it uses, as returned by
+VMTranslator.translate_separately, so they can be relinked with
+VMTranslator.link. They are keyed by a hash of the file's contents, its
+name (static symbols are named after the file), the translator options and
+the translator's own sources.
+
+A file only ever has one entry per set of options: prune() removes the
+entries of older versions of files, and, after a whole directory is
+translated, of files that are gone.
+"""
+import hashlib
+import json
+import os
+import os.path as op
+
+CACHE_DIR = ".vmcache"
+# Any change to these invalidates the cache
+SOURCES = ("VMTranslator.py", "translations.py", "vm_optimizer.py")
+
+_version = None
+
+
+def translator_version():
+    """Return a hash of the translator's sources."""
+    global _version
+    if _version is None:
+        h = hashlib.sha256()
+        for source in SOURCES:
+            with open(op.join(op.dirname(op.abspath(__file__)), source), "rb") as f:
+                h.update(f.read())
+        _version = h.hexdigest()
+
+    return _version
+
+
+def cache_key(fn, options):
+    """Return the cache key of the .vm file translated with options: the
+    file's name, a hash of the options and a hash of everything the
+    translation depends on, separated by dots.
+    """
+    name = op.basename(fn)
+    slot = hashlib.sha256(repr(options).encode()).hexdigest()[:16]
+    h = hashlib.sha256()
+    h.update(translator_version().encode())
+    h.update(name.encode())
+    h.update(repr(options).encode())
+    with open(fn, "rb") as f:
+        h.update(f.read())
+
+    return "{}.{}.{}".format(name, slot, h.hexdigest())
+
+
+def load(cache_dir, key):
+    """Return the (instructions, stubs) cached under key, or None."""
+    try:
+        with open(op.join(cache_dir, key), "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    return entry["asm"], set(entry["stubs"])
+
+
+def store(cache_dir, key, asm, stubs):
+    """Cache the instructions and stubs of a file under key."""
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so readers never see partial entries
+    tmp = op.join(cache_dir, "{}.{}.tmp".format(key, os.getpid()))
+    with open(tmp, "w") as f:
+        json.dump({"asm": asm, "stubs": sorted(stubs)}, f)
+    os.replace(tmp, op.join(cache_dir, key))
+
+
+def prune(cache_dir, keys, complete=False):
+    """Remove the entries replaced by keys: entries for the same file and
+    options under another key. If complete, keys are those of all the files
+    of the directory, and entries for any other file are removed too.
+    """
+    try:
+        entries = os.listdir(cache_dir)
+    except OSError:
+        return
+    names = {key.rsplit(".", 2)[0] for key in keys}
+    slots = {key.rsplit(".", 1)[0] for key in keys}
+    keys = set(keys)
+    for entry in entries:
+        parts = entry.rsplit(".", 2)
+        if entry in keys or entry.endswith(".tmp") or len(parts) != 3:
+            continue
+        if "{}.{}".format(*parts) in slots or complete and parts[0] not in names:
+            try:
+                os.remove(op.join(cache_dir, entry))
+            except FileNotFoundError:
+                pass
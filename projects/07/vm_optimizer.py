@@ -0,0 +1,150 @@
+"""Optimizer over parsed VM commands, run before translation.
+
+- Constant folding: push constant 3; push constant 4; add => push constant 7
+- Push/pop fusion: push local 0; pop argument 1 => a direct memory copy
+- Dead store elimination: a pop into temp, pointer or static that is
+  overwritten before being read in the same block only drops the value.
+
+Folding may produce negative constants and fusion produces 'move' and 'drop'
+commands, neither of which exists in the VM language. translations.py
+handles both.
+"""
+
+BINARY_OPS = {
+    "add": lambda x, y: x + y,
+    "sub": lambda x, y: x - y,
+    "and": lambda x, y: x & y,
+    "or": lambda x, y: x | y,
+    # Comparisons are done the same way as the translated code: on the
+    # 16-bit difference of the operands.
+    "eq": lambda x, y: -(to_signed(x - y) == 0),
+    "gt": lambda x, y: -(to_signed(x - y) > 0),
+    "lt": lambda x, y: -(to_signed(x - y) < 0),
+}
+UNARY_OPS = {
+    "neg": lambda x: -x,
+    "not": lambda x: ~x,
+}
+# Segments at fixed addresses, whose stores can be tracked
+DIRECT_SEGMENTS = {"pointer", "temp", "static"}
+# Segments accessed through a pointer that could alias anything
+ALIASED_SEGMENTS = {"this", "that"}
+# Commands that end a straight-line block
+BARRIER_COMMANDS = {"label", "goto", "if-goto", "function", "call", "return"}
+
+
+def to_signed(value):
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def join_lines(*commands):
+    return "; ".join(command.line for command in commands)
+
+
+def constant(command):
+    """Return the value pushed if the command pushes a constant, else None."""
+    if command.command == "push" and command.arg1 == "constant":
+        return int(command.arg2)
+    return None
+
+
+def push_constant(value, *commands):
+    """Return a command pushing value, replacing commands. Return None if the
+    value can't be represented.
+    """
+    value = to_signed(value)
+    if value == -0x8000:
+        return None
+    return commands[0]._replace(line=join_lines(*commands), command="push",
+                                arg1="constant", arg2=str(value))
+
+
+def fold(out, command):
+    """Try to fold or fuse command with the tail of out. Return True if out
+    was updated and command must not be appended.
+    """
+    if not out:
+        return False
+    last = out[-1]
+
+    if command.command in UNARY_OPS:
+        x = constant(last)
+        if x is not None:
+            folded = push_constant(UNARY_OPS[command.command](x), last, command)
+            if folded:
+                out[-1] = folded
+                return True
+    elif command.command in BINARY_OPS and len(out) > 1:
+        x, y = constant(out[-2]), constant(last)
+        if x is not None and y is not None:
+            folded = push_constant(BINARY_OPS[command.command](x, y), out[-2], last, command)
+            if folded:
+                out[-2:] = [folded]
+                return True
+    elif command.command == "pop" and last.command == "push":
+        src = (last.arg1, last.arg2)
+        dst = (command.arg1, command.arg2)
+        if src == dst:
+            # Pushing a value and popping it back does nothing
+            out.pop()
+        else:
+            out[-1] = last._replace(line=join_lines(last, command),
+                                    command="move", arg1=src, arg2=dst)
+        return True
+
+    return False
+
+
+def remove_dead_stores(commands):
+    """Walk each block backwards, tracking the direct locations that are
+    written before being read. Earlier stores to them are dead.
+    """
+    out = []
+    overwritten = set()
+    for command in reversed(commands):
+        if command.command in BARRIER_COMMANDS:
+            overwritten.clear()
+        elif command.command in {"pop", "move"}:
+            if command.command == "pop":
+                src, dst = None, (command.arg1, command.arg2)
+            else:
+                src, dst = command.arg1, command.arg2
+
+            if dst in overwritten:
+                if command.command == "move":
+                    continue
+                command = command._replace(command="drop", arg1=None, arg2=None)
+            elif dst[0] in DIRECT_SEGMENTS:
+                overwritten.add(dst)
+            elif dst[0] in ALIASED_SEGMENTS:
+                # Needs the value of pointer
+                overwritten.clear()
+
+            if src is not None:
+                overwritten.discard(src)
+                if src[0] in ALIASED_SEGMENTS:
+                    overwritten.clear()
+        elif command.command == "push":
+            overwritten.discard((command.arg1, command.arg2))
+            if command.arg1 in ALIASED_SEGMENTS:
+                overwritten.clear()
+
+        out.append(command)
+
+    out.reverse()
+    return out
+
+
+def optimize(commands):
+    """Take an iterable of commands (as returned by VMTranslator.parse_line)
+    and return an optimized list of commands.
+    """
+    out = []
+    for command in commands:
+        if not command:
+            continue
+        if not fold(out, command):
+            out.append(command)
+
+    return remove_dead_stores(out)
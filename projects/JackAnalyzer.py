@@ -1,39 +1,21 @@
 from os import path as op
-import collections
 import glob
-import re
 import sys
 import xml.etree.ElementTree as ET
 
-from tokenizer import Tokenizer
+from tokenizer import Tokenizer, TokenCursor
 import analyzer_engine
 
 
-class PeekaheadIterator():
-    def __init__(self, it):
-        self.it = it
-        self.items = collections.deque()
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.items:
-            return self.items.popleft()
-        return next(self.it)
-
-    def pushback(self, *items):
-        self.items.extendleft(items)
-
-    def peek(self):
-        """Return the next token without removing it."""
-        item = next(self)
-        self.pushback(item)
-        return item
+def write_xml(root, filename):
+    """Write a parse tree as XML, one element per line."""
+    # HACK: Their compare script is broken, need to post-process to match
+    x = ET.tostring(root).decode().replace("><", ">\n<")
+    with open(filename, "w") as f:
+        f.write(x)
 
 
 def main(filepath):
-    xml = []
     if op.isdir(filepath):
         path = filepath
         files = glob.glob("{}/*.jack".format(filepath))
@@ -43,13 +25,12 @@ def main(filepath):
 
     for fn in files:
         classname = op.splitext(op.basename(op.normpath(op.realpath(fn))))[0]
-        # Read in lines
-        tokenizer = Tokenizer(fn)
+        # Scanned once, for both outputs
+        tokens = Tokenizer(fn).tokens()
 
         # Create tokens XML
         root = ET.Element('tokens')
-        lex = tokenizer.lex()
-        for typ, token in lex:
+        for typ, token in tokens:
             ET.SubElement(root, typ).text=token
 
         # Write a new xml file
@@ -58,14 +39,8 @@ def main(filepath):
         tree.write("{}T.xml".format(classname))
 
         # Now create the parser xml
-        root = analyzer_engine.dispatch_compile(PeekaheadIterator(tokenizer.lex()))
-        tree = ET.ElementTree(root)
-        tree.write("{}.xml".format(classname))
-        # HACK: Their compare script is broken, need to post-process to match
-        with open("{}.xml".format(classname), "r") as f:
-            x = f.read().replace("><", ">\n<")
-        with open(op.join(path, "{}.xml".format(classname)), "w") as f:
-            f.write(x)
+        root = analyzer_engine.dispatch_compile(TokenCursor(tokens))
+        write_xml(root, op.join(path, "{}.xml".format(classname)))
 
 
 if __name__ == "__main__":
@@ -1,79 +1,32 @@
-from collections import namedtuple
 from os import path as op
-import collections
 import glob
-import re
 import sys
-import xml.etree.ElementTree as ET
 
+import analyzer_engine
 import compilation_engine
-from tokenizer import Tokenizer
-"""
-class VMWriter():
-    def __init__(self, file):
-        self.file = file
+import jack_ast
+from JackAnalyzer import write_xml
+from tokenizer import Tokenizer, TokenCursor
 
-    def write_push
-    def write_pop
-    def write_arith
-    def write_label
-    def write_goto
-    def write_if
-    def write_call
-    def write_function
-    def write_return
-    def close
-"""
+# Also write the parse tree XML, from the same parse as the VM code
+XML_FLAG = "-x"
 
-"""
-class CompilationEngine()
-# Takes tokens from tokenizer and writes output using VMWriter
-Read next token, dispatch to correct compilexxx method, emit vm code
-    def __init__
-    def compile_class
-    def compile_class_var_dec
-    def compile_subroutine_dec
-    def compile_parameter_list
-    def compile_subroutine_body
-    def compile_vardec
-    def compile_statements
-    def compile_do
-    def compile_let
-    def compile_while
-    def compile_return
-    def compile_if
-    def compile_expression
-    def compile_term
-    def compile_expression_list
-    """
-class PeekaheadIterator():
-    def __init__(self, it):
-        self.count = 0
-        self.it = it
-        self.items = collections.deque()
 
-    def __iter__(self):
-        return self
+def class_name(fn):
+    return op.splitext(op.basename(op.normpath(op.realpath(fn))))[0]
 
-    def __next__(self):
-        # Yuck. Needed to guarantee unique labels
-        self.count += 1
-        if self.items:
-            return self.items.popleft()
-        return next(self.it)
 
-    def pushback(self, *items):
-        self.items.extendleft(items)
+def parse_file(fn):
+    """Parse a .jack file into its syntax tree."""
+    return jack_ast.parse_class(TokenCursor(Tokenizer(fn).tokens()))
 
-    def peek(self):
-        """Return the next token without removing it."""
-        item = next(self)
-        self.pushback(item)
-        return item
 
+def compile_file(fn, f):
+    """Compile a .jack file, writing its VM code to f."""
+    compilation_engine.generate(class_name(fn), parse_file(fn), f)
 
-def main(filepath):
-    xml = []
+
+def main(filepath, xml=False):
     if op.isdir(filepath):
         path = filepath
         files = glob.glob("{}/*.jack".format(filepath))
@@ -82,17 +35,19 @@ def main(filepath):
         files = [filepath]
 
     for fn in files:
-        classname = op.splitext(op.basename(op.normpath(op.realpath(fn))))[0]
-        # Read in lines
-        tokenizer = Tokenizer(fn)
-
+        classname = class_name(fn)
+        tree = parse_file(fn)
         with open(op.join(path, "{}.vm".format(classname)), "w") as f:
-            compilation_engine.dispatch_compile(classname, PeekaheadIterator(tokenizer.lex()), f)
+            compilation_engine.generate(classname, tree, f)
+        if xml:
+            write_xml(analyzer_engine.compile_class(tree),
+                      op.join(path, "{}.xml".format(classname)))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: {} <input>".format(sys.argv[0]))
+    args = [arg for arg in sys.argv[1:] if arg != XML_FLAG]
+    if len(args) != 1:
+        print("Usage: {} [{}] <input>".format(sys.argv[0], XML_FLAG))
         sys.exit(1)
 
-    main(sys.argv[1])
+    main(args[0], xml=XML_FLAG in sys.argv[1:])
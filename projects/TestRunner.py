@@ -0,0 +1,529 @@
+#!/bin/env python
+
+import re
+import sys
+import glob
+import tempfile
+import os.path as op
+from collections import Counter
+from multiprocessing import Pool
+
+import HardwareSimulator
+import JackCompiler
+
+PROJECTS_DIR = op.dirname(op.abspath(__file__))
+sys.path.insert(0, op.join(PROJECTS_DIR, "06"))
+sys.path.insert(0, op.join(PROJECTS_DIR, "07"))
+import CPUEmulator
+import HackAssembler
+import VMEmulator
+import VMTranslator
+
+WORD_WIDTH = 16
+WORD_MASK = 0xFFFF
+# Scripts waiting on the keyboard would loop forever
+WHILE_LIMIT = 100000
+FLAGS = {
+    # Run the scripts one at a time, in this process
+    "-s": {"jobs": 1},
+}
+
+COMMENT_RE = r"(?P<comment>/\*.*?\*/|//[^\n]*)"
+STRING_RE = r'(?P<string>"[^"]*")'
+SEPARATOR_RE = r"(?P<separator>[,;{}])"
+WORD_RE = r"(?P<word>[^\s,;{}\"]+)"
+TST_TOKEN_RE = re.compile(r"|".join([COMMENT_RE, STRING_RE, SEPARATOR_RE, WORD_RE]), re.DOTALL)
+# A variable, a state of a chip or a bit of a pin: name, name[] or name[i]
+VARIABLE_RE = re.compile(r"(?P<name>[\w.]+)(?:\[(?P<index>\d*)\])?$")
+FORMAT_RE = re.compile(r"(?P<variable>.+)%(?P<format>[BDSX])(?P<left>\d+)\.(?P<width>\d+)\.(?P<right>\d+)$")
+CONDITIONS = {
+    "=": lambda a, b: a == b,
+    "<>": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b,
+    "<=": lambda a, b: a <= b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+class ScriptError(Exception):
+    pass
+
+
+class Mismatch(Exception):
+    pass
+
+
+class NeedsInput(Exception):
+    """A script waits for input only a user can give, like a key press."""
+
+
+def tokenize(text):
+    for match in TST_TOKEN_RE.finditer(text):
+        if match.lastgroup != "comment":
+            yield match.group()
+
+
+def parse(tokens):
+    """Parse script tokens into a list of commands. A command is a list of
+    words, or ("repeat", count, commands) or ("while", condition, commands)
+    where count is None to repeat forever.
+    """
+    commands = []
+    words = []
+    while True:
+        token = next(tokens, None)
+        if token in (None, "}"):
+            if words:
+                commands.append(words)
+            return commands
+        if token in (",", ";"):
+            if words:
+                commands.append(words)
+            words = []
+        elif token == "{":
+            if words[0] == "repeat":
+                commands.append(("repeat", int(words[1]) if len(words) > 1 else None, parse(tokens)))
+            elif words[0] == "while":
+                commands.append(("while", words[1:], parse(tokens)))
+            else:
+                raise ScriptError("Unexpected {{ after {}".format(" ".join(words)))
+            words = []
+        else:
+            words.append(token)
+
+
+def parse_value(text):
+    """Parse a value: decimal, or %B, %X or %D followed by digits."""
+    bases = {"%B": 2, "%X": 16, "%D": 10}
+    if text[:2] in bases:
+        return int(text[2:], bases[text[:2]])
+    return int(text)
+
+
+def to_signed(value):
+    return value - (1 << WORD_WIDTH) if value & (1 << (WORD_WIDTH - 1)) else value
+
+
+class Column():
+    """An output-list entry: variable%Fleft.width.right."""
+    def __init__(self, spec):
+        match = FORMAT_RE.match(spec)
+        if not match:
+            raise ScriptError("Bad output format: {}".format(spec))
+        self.variable = match.group("variable")
+        self.format = match.group("format")
+        self.left, self.width, self.right = (int(match.group(n)) for n in ("left", "width", "right"))
+
+    def header(self):
+        size = self.left + self.width + self.right
+        return self.variable[:size].center(size)
+
+    def cell(self, value, width):
+        if self.format == "S":
+            text = str(value).ljust(self.width)
+        elif self.format == "D":
+            text = str(to_signed(value) if width == WORD_WIDTH else value).rjust(self.width)
+        elif self.format == "B":
+            text = "{:0{}b}".format(value & ((1 << self.width) - 1), self.width)
+        else:
+            text = "{:0{}X}".format(value & ((1 << (4 * self.width)) - 1), self.width)
+        return " " * self.left + text + " " * self.right
+
+
+class Comparator():
+    """Compares output lines with a .cmp file as they're produced. Cells are
+    compared without surrounding spaces, and a cell of *s matches anything.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.f = open(fn, "r")
+        self.line_number = 0
+
+    def close(self):
+        self.f.close()
+
+    @staticmethod
+    def cells(line):
+        return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+    def check(self, line):
+        self.line_number += 1
+        expected = self.f.readline()
+        if not expected:
+            raise Mismatch("{}: output past the end, got {}".format(self.fn, line))
+        for got, want in zip(self.cells(line), self.cells(expected)):
+            if got != want and want.strip("*"):
+                break
+        else:
+            if len(self.cells(line)) == len(self.cells(expected)):
+                return
+        raise Mismatch("{} line {}:\n  expected {}\n  got      {}".format(
+            self.fn, self.line_number, expected.rstrip("\n"), line))
+
+    def finish(self):
+        rest = self.f.readline()
+        if rest.strip():
+            raise Mismatch("{} line {}: output ended, expected {}".format(
+                self.fn, self.line_number + 1, rest.rstrip("\n")))
+
+
+class ChipTest():
+    """Drives the HDL simulator."""
+    def __init__(self, fn):
+        self.path = op.dirname(fn)
+        dirs = [self.path]
+        name = op.splitext(op.basename(fn))[0]
+        substitute = HardwareSimulator.substitutes(name, dirs, test=chip_test_passes)
+        self.sim = HardwareSimulator.Simulator(name, dirs, substitute=substitute)
+        self.time = 0
+        self.half = False
+
+    def state(self, name):
+        parts = self.sim.parts(name)
+        if not parts or not hasattr(parts[0], "__getitem__"):
+            raise ScriptError("No builtin chip with state {}".format(name))
+        return parts[0]
+
+    def set(self, variable, value):
+        match = VARIABLE_RE.match(variable)
+        name, index = match.group("name"), match.group("index")
+        if index is None:
+            self.sim.set(name, value)
+        else:
+            self.state(name)[int(index or 0)] = value
+
+    def get(self, variable):
+        """Return the value of a variable and its width in bits."""
+        match = VARIABLE_RE.match(variable)
+        name, index = match.group("name"), match.group("index")
+        if name == "time":
+            return "{}{}".format(self.time, "+" if self.half else ""), None
+        if name in self.sim.widths:
+            if index:
+                return (self.sim.get(name) >> int(index)) & 1, 1
+            return self.sim.get(name), self.sim.widths[name]
+        return self.state(name)[int(index or 0)], WORD_WIDTH
+
+    def command(self, words):
+        if words == ["eval"]:
+            self.sim.eval()
+        elif words == ["tick"]:
+            self.sim.tick()
+            self.half = True
+        elif words == ["tock"]:
+            self.sim.tock()
+            self.time += 1
+            self.half = False
+        elif len(words) == 3 and words[1] == "load":
+            self.state(words[0]).load(load_words(op.join(self.path, words[2])))
+        else:
+            raise ScriptError("Unknown command: {}".format(" ".join(words)))
+
+    def step(self, count):
+        for _ in range(count):
+            self.command(["tick"])
+            self.command(["tock"])
+
+    def waiting_for_key(self):
+        """Whether the chip has a keyboard with no key pressed."""
+        return any(keyboard[0] == 0 for keyboard in self.sim.parts("Keyboard"))
+
+
+class CPUTest():
+    """Drives the CPU emulator."""
+    def __init__(self, fn):
+        words, leaders = load_program(fn)
+        self.cpu = CPUEmulator.BlockCPU(words, leaders)
+        self.time = 0
+
+    def set(self, variable, value):
+        match = VARIABLE_RE.match(variable)
+        name, index = match.group("name"), match.group("index")
+        if name == "RAM":
+            self.cpu.ram[int(index)] = value & WORD_MASK
+        elif name in ("A", "D", "PC"):
+            setattr(self.cpu, name.lower(), value & WORD_MASK)
+            self.cpu.halted = False
+        else:
+            raise ScriptError("Unknown variable: {}".format(variable))
+
+    def get(self, variable):
+        match = VARIABLE_RE.match(variable)
+        name, index = match.group("name"), match.group("index")
+        if name == "time":
+            return self.time, None
+        if name == "RAM":
+            return self.cpu.ram[int(index)], WORD_WIDTH
+        if name in ("A", "D", "PC"):
+            return getattr(self.cpu, name.lower()), WORD_WIDTH
+        raise ScriptError("Unknown variable: {}".format(variable))
+
+    def command(self, words):
+        if words == ["ticktock"]:
+            self.step(1)
+        else:
+            raise ScriptError("Unknown command: {}".format(" ".join(words)))
+
+    def step(self, count):
+        # Once halted, the CPU would keep jumping to itself
+        self.cpu.run(count)
+        self.time += count
+
+    def waiting_for_key(self):
+        # Scripts drive the keyboard through RAM: a loop can't be told apart
+        # from a program that never ends
+        return False
+
+
+class VMTest():
+    """Drives the VM emulator."""
+    POINTERS = {"sp": 0, "local": 1, "argument": 2, "this": 3, "that": 4}
+
+    def __init__(self, fn):
+        with tempfile.TemporaryDirectory() as tmp:
+            files, bootstrap = vm_files(fn, tmp)
+            # The OS runs natively, taking a step per call like the Java VM emulator's
+            self.vm = VMEmulator.VM(files, bootstrap, builtins=True)
+        self.time = 0
+
+    def address(self, variable):
+        match = VARIABLE_RE.match(variable)
+        name, index = match.group("name"), match.group("index")
+        if name == "RAM":
+            return int(index)
+        if name == "temp":
+            return VMEmulator.SEGMENT_BASES["temp"] + int(index)
+        if name in self.POINTERS and not index:
+            return self.POINTERS[name]
+        if name in VMEmulator.SEGMENT_POINTERS:
+            return self.vm.ram[VMEmulator.SEGMENT_POINTERS[name]] + int(index)
+        raise ScriptError("Unknown variable: {}".format(variable))
+
+    def set(self, variable, value):
+        self.vm.ram[self.address(variable)] = value & WORD_MASK
+
+    def get(self, variable):
+        if variable == "time":
+            return self.time, None
+        return self.vm.ram[self.address(variable)], WORD_WIDTH
+
+    def command(self, words):
+        if words == ["vmstep"]:
+            self.step(1)
+        else:
+            raise ScriptError("Unknown command: {}".format(" ".join(words)))
+
+    def step(self, count):
+        self.vm.run(count)
+        self.time += count
+
+    def waiting_for_key(self):
+        # As for the CPU, the keyboard is just RAM
+        return False
+
+
+def vm_files(fn, tmp):
+    """Return the .vm files to load for a file or directory, and whether to
+    bootstrap. Like the Java VM emulator, a directory's .jack files are
+    compiled (into tmp) and the OS classes it calls but lacks come from
+    tools/OS.
+    """
+    path, module, files, bootstrap = VMTranslator.find_files(fn)
+    if op.isdir(fn):
+        def classname(fn):
+            return op.splitext(op.basename(fn))[0]
+
+        classes = {classname(vm) for vm in files}
+        for jack in sorted(glob.glob(op.join(fn, "*.jack"))):
+            if classname(jack) not in classes:
+                vm = op.join(tmp, classname(jack) + ".vm")
+                with open(vm, "w") as f:
+                    JackCompiler.compile_file(jack, f)
+                files.append(vm)
+                classes.add(classname(jack))
+
+    return VMEmulator.add_os(files, bootstrap), bootstrap
+
+
+def load_words(fn):
+    return load_program(fn)[0]
+
+
+def load_program(fn):
+    """Return the words and block leaders of a program. Missing .hack files
+    are assembled from their .asm, and missing .asm files translated from
+    the .vm files next to them.
+    """
+    root, ext = op.splitext(fn)
+    if op.exists(fn) or ext not in (".hack", ".asm"):
+        return CPUEmulator.load_program(fn), CPUEmulator.load_leaders(fn)
+    if ext == ".hack" and op.exists(root + ".asm"):
+        return load_program(root + ".asm")
+
+    # Like VMTranslator: the .vm file of the same name, else the directory
+    vm = root + ".vm"
+    path, module, files, bootstrap = VMTranslator.find_files(vm if op.exists(vm) else op.dirname(fn))
+    if not files:
+        raise ScriptError("Can't find {}".format(fn))
+    asm = list(VMTranslator.translate(files, bootstrap))
+    _, labels = HackAssembler.parse(asm)
+    return HackAssembler.assemble(asm), set(labels.values())
+
+
+MACHINES = {
+    ".hdl": ChipTest,
+    ".hack": CPUTest,
+    ".asm": CPUTest,
+    ".bin": CPUTest,
+    ".binbe": CPUTest,
+    ".vm": VMTest,
+    "": VMTest,
+}
+
+
+class Script():
+    """Runs a test script, comparing its output with its .cmp file."""
+    def __init__(self, fn):
+        self.fn = fn
+        self.path = op.dirname(op.abspath(fn))
+        with open(fn, "r") as f:
+            self.commands = parse(tokenize(f.read()))
+        self.machine = None
+        self.columns = []
+        self.comparator = None
+
+    def run(self):
+        try:
+            self.execute(self.commands)
+            if self.comparator:
+                self.comparator.finish()
+        finally:
+            if self.comparator:
+                self.comparator.close()
+
+    def execute(self, commands):
+        for command in commands:
+            if command[0] == "repeat":
+                _, count, body = command
+                if count is not None and len(body) == 1 and body[0] in (["ticktock"], ["vmstep"]):
+                    self.machine.step(count)
+                    continue
+                iterations = range(count) if count is not None else iter(int, 1)
+                for _ in iterations:
+                    self.execute(body)
+            elif command[0] == "while":
+                _, condition, body = command
+                for _ in range(WHILE_LIMIT):
+                    if not self.condition(condition):
+                        break
+                    self.execute(body)
+                else:
+                    if self.machine.waiting_for_key():
+                        raise NeedsInput("while {} waits for a key press".format(
+                            " ".join(condition)))
+                    raise ScriptError("while {} is still true after {} iterations".format(
+                        " ".join(condition), WHILE_LIMIT))
+            else:
+                self.simple(command)
+
+    def condition(self, words):
+        if len(words) != 3 or words[1] not in CONDITIONS:
+            raise ScriptError("Bad condition: {}".format(" ".join(words)))
+        value, width = self.machine.get(words[0])
+        if width == WORD_WIDTH:
+            value = to_signed(value)
+        return CONDITIONS[words[1]](value, parse_value(words[2]))
+
+    def simple(self, words):
+        name = words[0]
+        if name == "load":
+            target = op.join(self.path, words[1]) if len(words) > 1 else self.path
+            ext = op.splitext(words[1])[1] if len(words) > 1 else ""
+            if ext not in MACHINES:
+                raise ScriptError("Can't load {}".format(target))
+            self.machine = MACHINES[ext](target)
+        elif name == "compare-to":
+            self.comparator = Comparator(op.join(self.path, words[1]))
+        elif name == "output-list":
+            self.columns = [Column(spec) for spec in words[1:]]
+            self.write("|" + "|".join(column.header() for column in self.columns) + "|")
+        elif name == "output":
+            cells = [column.cell(*self.machine.get(column.variable)) for column in self.columns]
+            self.write("|" + "|".join(cells) + "|")
+        elif name == "set":
+            self.machine.set(words[1], parse_value(words[2]))
+        elif name in ("output-file", "echo", "clear-echo"):
+            pass
+        else:
+            self.machine.command(words)
+
+    def write(self, line):
+        if self.comparator:
+            self.comparator.check(line)
+
+
+def run_script(fn):
+    """Run a script. Return its path, PASS, FAIL or SKIP (when it needs a
+    user), and None if it passed, else what went wrong.
+    """
+    try:
+        Script(fn).run()
+    except NeedsInput as e:
+        return fn, "SKIP", str(e)
+    except (Mismatch, ScriptError, HardwareSimulator.HDLError) as e:
+        return fn, "FAIL", str(e)
+    except Exception as e:
+        return fn, "FAIL", "{}: {}".format(type(e).__name__, e)
+    return fn, "PASS", None
+
+
+def find_scripts(paths):
+    """Return the scripts given or under the directories given, skipping
+    those without a .cmp file to compare with.
+    """
+    scripts = []
+    for path in paths:
+        if op.isdir(path):
+            scripts.extend(sorted(glob.glob(op.join(path, "**", "*.tst"), recursive=True)))
+        else:
+            scripts.append(path)
+
+    def compared(fn):
+        with open(fn, "r") as f:
+            return "compare-to" in f.read()
+
+    return [fn for fn in scripts if compared(fn)]
+
+
+def chip_test_passes(fn):
+    """Return whether the test script of the chip in the HDL file fn passes,
+    or None if it has none comparing its output, or it needs a user.
+    """
+    script = op.splitext(fn)[0] + ".tst"
+    if not op.exists(script) or not find_scripts([script]):
+        return None
+    _, outcome, _ = run_script(script)
+    return None if outcome == "SKIP" else outcome == "PASS"
+
+
+def main(*paths, jobs=None):
+    scripts = find_scripts(paths or [PROJECTS_DIR])
+    outcomes = Counter()
+    pool = Pool(jobs) if jobs != 1 else None
+    results = pool.imap_unordered(run_script, scripts) if pool else map(run_script, scripts)
+    for fn, outcome, message in results:
+        print("{} {}".format(outcome, op.relpath(fn)))
+        outcomes[outcome] += 1
+        if message:
+            print("  " + message.replace("\n", "\n  "))
+    if pool:
+        pool.close()
+
+    print("{} passed, {} failed, {} skipped".format(
+        outcomes["PASS"], outcomes["FAIL"], outcomes["SKIP"]))
+    return outcomes["FAIL"]
+
+if __name__ == "__main__":
+    args, options = VMTranslator.parse_flags(sys.argv[1:], FLAGS)
+    sys.exit(1 if main(*args, **options) else 0)
@@ -1,139 +1,70 @@
 import xml.etree.ElementTree as ET
 
-TYPES = {"int", "char", "boolean", "void"}
-IDENTIFIER_KEYWORDS = {"this"}
-INFIX_OPS = {"+", "-", "*", "/", "&", "|", "<", ">", "="}
-UNARY_OPS = {"-", "~"}
-KEYWORD_CONSTANTS = {"true", "false", "null", "this"}
+import jack_ast
+from jack_ast import TYPES
 
 
-class JackSyntaxError(Exception):
-    """An exception raised when the compiler hits an unexpected case."""
-
-
-def expect(token, value):
-    if token[1] != value:
-        raise JackSyntaxError("Expected '{}', got '{}'".format(value, token[1]))
+def dispatch_compile(tokengen):
+    """Parse a class from tokens and return its XML tree."""
+    return compile_class(jack_ast.parse_class(tokengen))
 
 
-def expect_type(token, value):
-    if token[0] != value:
-        raise JackSyntaxError("Expected type '{}', got '{}'".format(value, token[0]))
+def leaf(root, tag, text):
+    node = ET.SubElement(root, tag)
+    node.text = text
+    return node
 
 
-def dispatch_compile(tokengen):
-    token = next(tokengen)
-    ttype, value = token
-    if ttype == "keyword":
-        if value == "class":
-            return compile_class(token, tokengen)
-        elif value == "static" or value == "field":
-            return compile_classvardec(token, tokengen)
-        elif value == "constructor" or value == "function" or value == "method":
-            return compile_subroutine(token, tokengen)
-        elif value == "var":
-            return compile_vardec(token, tokengen)
-    else:
-        raise JackSyntaxError
+def type_leaf(root, typ):
+    return leaf(root, "keyword" if typ in TYPES else "identifier", typ)
 
 
-def compile_class(t, tokengen):
+def compile_class(node):
     """
     'class' className '{' classVarDec* subroutineDec* '}'
     """
-    # class keyword
     root = ET.Element("class")
-    node = ET.SubElement(root, "keyword")
-    node.text = "class"
-    t = next(tokengen)
-    # className
-    node = ET.SubElement(root, "identifier")
-    node.text = t[1]
-    t = next(tokengen)
-    # '{' symbol
-    expect(t, "{")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-
-    # classvars
-    while t[0] == "keyword" and (t[1] == "static" or t[1] == "field"):
-        node = compile_classvardec(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-
-    # subroutines
-    while t[0] == "keyword" and (t[1] == "constructor" or t[1] == "function" or t[1] == "method"):
-        node = compile_subroutine(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-
-    # '}' symbol
-    expect(t, "}")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
+    leaf(root, "keyword", "class")
+    leaf(root, "identifier", node.name)
+    leaf(root, "symbol", "{")
+    for dec in node.class_vars:
+        root.append(compile_vardec(dec, el="classVarDec"))
+    for subroutine in node.subroutines:
+        root.append(compile_subroutine(subroutine))
+    leaf(root, "symbol", "}")
     return root
 
 
-def compile_subroutine(t, tokengen):
+def compile_subroutine(node):
     """
     ('constructor' | 'function' | 'method') ('void' | type) subroutineName '(' parameterList ')'
     subroutineBody
     """
     root = ET.Element("subroutineDec")
-    # constructor, function, or method
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # type
-    if t[0] == "identifier":
-        node = ET.SubElement(root, "identifier")
-    else:
-        node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # subroutineName
-    node = ET.SubElement(root, "identifier")
-    node.text = t[1]
-    t = next(tokengen)
-    # '(' parameterList ')'
-    node = compile_parameter_list(t, tokengen)
-    root.extend(node)
-    t = next(tokengen)
-    # subroutineBody
-    node = compile_subroutine_body(t, tokengen)
-    root.append(node)
+    leaf(root, "keyword", node.kind)
+    type_leaf(root, node.return_type)
+    leaf(root, "identifier", node.name)
+    leaf(root, "symbol", "(")
+    root.append(compile_parameter_list(node.parameters))
+    leaf(root, "symbol", ")")
+    root.append(compile_subroutine_body(node))
     return root
 
 
-def compile_subroutine_body(t, tokengen):
+def compile_subroutine_body(node):
     """
     '{' varDec* statements '}'
     """
     root = ET.Element("subroutineBody")
-    # '{'
-    expect(t, "{")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    while t[1] == "var":
-        node = compile_vardec(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-    node = compile_statements(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-    expect(t, "}")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
+    leaf(root, "symbol", "{")
+    for dec in node.locals:
+        root.append(compile_vardec(dec))
+    root.append(compile_statements(node.statements))
+    leaf(root, "symbol", "}")
     return root
 
 
-def compile_classvardec(t, tokengen):
-    return compile_vardec(t, tokengen, el="classVarDec")
-
-
-def compile_vardec(t, tokengen, el="varDec"):
+def compile_vardec(node, el="varDec"):
     """
     Normal:
     'var' type varName (',', varName)* ';'
@@ -141,499 +72,197 @@ def compile_vardec(t, tokengen, el="varDec"):
     ('static' | 'field') type varName (',' varName)* ';'
     """
     root = ET.Element(el)
-    # var, static, or field
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # type
-    if t[1] in TYPES:
-        node = ET.SubElement(root, "keyword")
-        node.text = t[1]
-    else:
-        node = ET.SubElement(root, "identifier")
-        node.text = t[1]
-    t = next(tokengen)
-    # varName
-    node = ET.SubElement(root, "identifier")
-    node.text = t[1]
-    t = next(tokengen)
-    while t[1] == ",":
-        # comma symbol
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-        t = next(tokengen)
-        # varName
-        node = ET.SubElement(root, "identifier")
-        node.text = t[1]
-        t = next(tokengen)
-    # Semicolon
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
+    leaf(root, "keyword", node.kind)
+    type_leaf(root, node.type)
+    for i, name in enumerate(node.names):
+        if i:
+            leaf(root, "symbol", ",")
+        leaf(root, "identifier", name)
+    leaf(root, "symbol", ";")
     return root
 
 
-def compile_parameter_list(t, tokengen):
+def compile_parameter_list(parameters):
     """
     ((type varName)(',' type varName)*)?
     """
-    # We include the surrounding parens
-    # '('
-    nodes = []
-    node = ET.Element("symbol")
-    node.text = t[1]
-    nodes.append(node)
-    t = next(tokengen)
-    # parameterList
     root = ET.Element("parameterList")
     root.text = "\n"
-    while t[1] in TYPES or t[0] == "identifier":
-        # type
-        if t[1] in TYPES:
-            node = ET.SubElement(root, "keyword")
-            node.text = t[1]
-        else:
-            node = ET.SubElement(root, "identifier")
-            node.text = t[1]
-        t = next(tokengen)
-        # varName
-        node = ET.SubElement(root, "identifier")
-        node.text = t[1]
-        t = next(tokengen)
-
-        while t[1] == ",":
-            # comma
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-            t = next(tokengen)
-            # type
-            if t[1] in TYPES:
-                node = ET.SubElement(root, "keyword")
-                node.text = t[1]
-            else:
-                node = ET.SubElement(root, "identifier")
-                node.text = t[1]
-            t = next(tokengen)
-            # varName
-            node = ET.SubElement(root, "identifier")
-            node.text = t[1]
-            t = next(tokengen)
-    nodes.append(root)
-    # ')'
-    expect(t, ")")
-    node = ET.Element("symbol")
-    node.text = t[1]
-    nodes.append(node)
-
-    return nodes
-
-
-def compile_do(t, tokengen):
+    for i, (typ, name) in enumerate(parameters):
+        if i:
+            leaf(root, "symbol", ",")
+        type_leaf(root, typ)
+        leaf(root, "identifier", name)
+    return root
+
+
+def compile_block(root, statements):
+    """
+    '{' statements '}'
+    """
+    leaf(root, "symbol", "{")
+    root.append(compile_statements(statements))
+    leaf(root, "symbol", "}")
+
+
+def compile_condition(root, condition):
+    """
+    '(' expression ')'
+    """
+    leaf(root, "symbol", "(")
+    root.append(compile_expression(condition))
+    leaf(root, "symbol", ")")
+
+
+def compile_do(node):
     """
     'do' subroutineCall ';'
-         subroutineName '(' expressionList ')' | (className | varName) '.' subroutineName '(' expressionList ')'
     """
     root = ET.Element("doStatement")
-    # let keyword
-    expect(t, "do")
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # Either a subroutineName directly or an object or varName followed by a dot and a subroutine name
-    # Either way, it's first an identifier
-    # -- subroutineName OR className | varName
-    node = ET.SubElement(root, "identifier")
-    node.text = t[1]
-    t = next(tokengen)
-    if t[1] == ".":  # Method call
-        # -- '.' symbol
-        expect(t, ".")
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-        t = next(tokengen)
-        # subroutineName
-        node = ET.SubElement(root, "identifier")
-        node.text = t[1]
-        t = next(tokengen)
-
-    # '(' symbol
-    expect(t, "(")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-
-    # expressionList
-    node = compile_expression_list(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-
-    # ')' symbol
-    expect(t, ")")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-
-    # ';' symbol
-    expect(t, ";")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-
+    leaf(root, "keyword", "do")
+    compile_call(root, node.call)
+    leaf(root, "symbol", ";")
     return root
 
 
-def compile_let(t, tokengen):
+def compile_let(node):
     """
     'let' varName( '[' expression ']' )? '=' expression ';'
     """
     root = ET.Element("letStatement")
-    # let keyword
-    expect(t, "let")
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # varName
-    node = ET.SubElement(root, "identifier")
-    node.text = t[1]
-    t = next(tokengen)
-    # Allow square brackets
-    if t[1] == "[":
-        # '[' symbol
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-        t = next(tokengen)
-        # single expression
-        node = compile_expression(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-        # ']' symbol
-        expect(t, "]")
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-        t = next(tokengen)
-    # '='
-    expect(t, "=")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # single expression
-    node = compile_expression(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-    # ';'
-    expect(t, ";")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-
+    leaf(root, "keyword", "let")
+    leaf(root, "identifier", node.name)
+    if node.index is not None:
+        leaf(root, "symbol", "[")
+        root.append(compile_expression(node.index))
+        leaf(root, "symbol", "]")
+    leaf(root, "symbol", "=")
+    root.append(compile_expression(node.value))
+    leaf(root, "symbol", ";")
     return root
 
 
-def compile_while(t, tokengen):
+def compile_while(node):
     """
     'while' '(' expression ')' '{' statements '}'
     """
     root = ET.Element("whileStatement")
-    # while keyword
-    expect(t, "while")
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # '(' symbol
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # single expression
-    node = compile_expression(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-    # ')' symbol
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # '{' symbol
-    expect(t, "{")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # statements
-    node = compile_statements(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-    # '}' symbol
-    expect(t, "}")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-
+    leaf(root, "keyword", "while")
+    compile_condition(root, node.condition)
+    compile_block(root, node.body)
     return root
 
 
-def compile_return(t, tokengen):
+def compile_return(node):
     """
     'return' expression? ';'
     """
     root = ET.Element("returnStatement")
-    # return keyword
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # 1 or 0 expressions
-    if t[1] != ";":
-        node = compile_expression(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-    # Semicolon
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-
+    leaf(root, "keyword", "return")
+    if node.value is not None:
+        root.append(compile_expression(node.value))
+    leaf(root, "symbol", ";")
     return root
 
 
-def compile_if(t, tokengen):
+def compile_if(node):
     """
     'if' '(' expression ')' '{' statements '}'
     ('else' '{' statements '}')?
     """
     root = ET.Element("ifStatement")
-    # if keyword
-    expect(t, "if")
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # '(' symbol
-    expect(t, "(")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # single expression
-    node = compile_expression(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-    # ')' symbol
-    expect(t, ")")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # '{' symbol
-    expect(t, "{")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # statements
-    node = compile_statements(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-    # '}' symbol
-    expect(t, "}")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-
-    tp = tokengen.peek()
-    if tp[1] != "else":
-        return root
-
-    t = next(tokengen)
-    # else keyword
-    expect(t, "else")
-    node = ET.SubElement(root, "keyword")
-    node.text = t[1]
-    t = next(tokengen)
-    # '{' symbol
-    expect(t, "{")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-    t = next(tokengen)
-    # statements
-    node = compile_statements(t, tokengen)
-    root.append(node)
-    t = next(tokengen)
-    # '}' symbol
-    expect(t, "}")
-    node = ET.SubElement(root, "symbol")
-    node.text = t[1]
-
+    leaf(root, "keyword", "if")
+    compile_condition(root, node.condition)
+    compile_block(root, node.then)
+    if node.otherwise is not None:
+        leaf(root, "keyword", "else")
+        compile_block(root, node.otherwise)
     return root
 
 
 STATEMENT_TYPES = {
-    "let": compile_let,
-    "if": compile_if,
-    "while": compile_while,
-    "do": compile_do,
-    "return": compile_return,
+    jack_ast.Let: compile_let,
+    jack_ast.If: compile_if,
+    jack_ast.While: compile_while,
+    jack_ast.Do: compile_do,
+    jack_ast.Return: compile_return,
 }
 
 
-def compile_statements(t, tokengen):
+def compile_statements(statements):
     root = ET.Element("statements")
-    while t[1] != '}': # TODO: Better test?
-        node = compile_statement(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-
-    tokengen.pushback(t)
+    for statement in statements:
+        root.append(STATEMENT_TYPES[type(statement)](statement))
     return root
 
 
-def compile_statement(t, tokengen):
-    return STATEMENT_TYPES[t[1]](t, tokengen)
+def compile_call(root, node):
+    """
+    subroutineName '(' expressionList ')' |
+    (className | varName) '.' subroutineName '(' expressionList ')'
+    The call's elements are added straight to root.
+    """
+    if node.receiver is not None:
+        leaf(root, "identifier", node.receiver)
+        leaf(root, "symbol", ".")
+    leaf(root, "identifier", node.name)
+    leaf(root, "symbol", "(")
+    root.append(compile_expression_list(node.args))
+    leaf(root, "symbol", ")")
 
 
-def compile_term(t, tokengen):
+def compile_term(node):
     """
     integerConstant | stringConstant | keywordConstant |
     varName | varName '[' expression ']' | subroutineCall |
     '(' expression ')' | unaryOp term
-    This has to do a look ahead to distinguish between:
-    varName
-    varName '[' expression ']'
-    subroutine call:
-      subroutineName '(' expressionList ')' |
-      (className | varName) '.' subroutineName '(' expressionList ')'
     """
     root = ET.Element("term")
-    if t[0] in {"integerConstant", "stringConstant"}:
-        node = ET.SubElement(root, t[0])
-        node.text = t[1]
-    elif t[1] in KEYWORD_CONSTANTS:
-        node = ET.SubElement(root, "keyword")
-        node.text = t[1]
-    elif t[1] in UNARY_OPS:
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-        t = next(tokengen)
-        node = compile_term(t, tokengen)
-        root.append(node)
-    elif t[1] == "(":
-        # '(' symbol
-        expect(t, "(")
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-        t = next(tokengen)
-
-        # expression
-        node = compile_expression(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-
-        # ')' symbol
-        expect(t, ")")
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-    else:  # an identifier, with either possibly a call or indexing
-        expect_type(t, "identifier")
-        node = ET.SubElement(root, "identifier")
-        node.text = t[1]
-        tp = tokengen.peek()
-        if tp[1] == ".":  # Method call
-            t = next(tokengen)
-            # -- '.' symbol
-            expect(t, ".")
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-            t = next(tokengen)
-            # subroutineName
-            node = ET.SubElement(root, "identifier")
-            node.text = t[1]
-            t = next(tokengen)
-
-            # '(' symbol
-            expect(t, "(")
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-            t = next(tokengen)
-
-            # expressionList
-            node = compile_expression_list(t, tokengen)
-            root.append(node)
-            t = next(tokengen)
-
-            # ')' symbol
-            expect(t, ")")
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-        elif tp[1] == "[":  # Array access
-            t = next(tokengen)
-            # '[' symbol
-            expect(t, "[")
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-            t = next(tokengen)
-
-            # expression
-            node = compile_expression(t, tokengen)
-            root.append(node)
-            t = next(tokengen)
-
-            # ']' symbol
-            expect(t, "]")
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-        elif tp[1] == "(":  # Function call
-            t = next(tokengen)
-            # '(' symbol
-            expect(t, "(")
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-            t = next(tokengen)
-
-            # expressionList
-            node = compile_expression_list(t, tokengen)
-            root.append(node)
-            t = next(tokengen)
-
-            # ')' symbol
-            expect(t, ")")
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-            # t = next(tokengen)
-        else:  # Just a reference
-            # In this case we DON'T pop the peeked token
-            pass
-
+    if isinstance(node, jack_ast.IntegerConstant):
+        leaf(root, "integerConstant", node.value)
+    elif isinstance(node, jack_ast.StringConstant):
+        leaf(root, "stringConstant", node.value)
+    elif isinstance(node, jack_ast.KeywordConstant):
+        leaf(root, "keyword", node.value)
+    elif isinstance(node, jack_ast.Unary):
+        leaf(root, "symbol", node.op)
+        root.append(compile_term(node.term))
+    elif isinstance(node, jack_ast.Parenthesized):
+        leaf(root, "symbol", "(")
+        root.append(compile_expression(node.expression))
+        leaf(root, "symbol", ")")
+    elif isinstance(node, jack_ast.Call):
+        compile_call(root, node)
+    elif isinstance(node, jack_ast.ArrayRef):
+        leaf(root, "identifier", node.name)
+        leaf(root, "symbol", "[")
+        root.append(compile_expression(node.index))
+        leaf(root, "symbol", "]")
+    else:
+        leaf(root, "identifier", node.name)
     return root
 
 
-def compile_expression_list(t, tokengen):
+def compile_expression_list(expressions):
     """
     (expression (',' expression)*)?
     """
     root = ET.Element("expressionList")
     root.text = "\n"
-    while t[1] != ")":
-        node = compile_expression(t, tokengen)
-        root.append(node)
-        t = next(tokengen)
-        while t[1] == ",":
-            # comma symbol
-            node = ET.SubElement(root, "symbol")
-            node.text = t[1]
-            t = next(tokengen)
-
-            node = compile_expression(t, tokengen)
-            root.append(node)
-            t = next(tokengen)
-
-    tokengen.pushback(t)
+    for i, expression in enumerate(expressions):
+        if i:
+            leaf(root, "symbol", ",")
+        root.append(compile_expression(expression))
     return root
 
 
-def compile_expression(t, tokengen):
+def compile_expression(node):
     """
     term (op term)*
     """
     root = ET.Element("expression")
-    # term
-    node = compile_term(t, tokengen)
-    root.append(node)
-    t = tokengen.peek()
-    while t[1] in INFIX_OPS:
-        # remove peeked value
-        next(tokengen)
-        # op
-        node = ET.SubElement(root, "symbol")
-        node.text = t[1]
-        t = next(tokengen)
-        # term
-        node = compile_term(t, tokengen)
-        root.append(node)
-        t = tokengen.peek()
-
+    root.append(compile_term(node.terms[0]))
+    for op, term in zip(node.ops, node.terms[1:]):
+        leaf(root, "symbol", op)
+        root.append(compile_term(term))
     return root
@@ -1,8 +1,7 @@
 import collections
-import xml.etree.ElementTree as ET
 
-TYPES = {"int", "char", "boolean", "void"}
-IDENTIFIER_KEYWORDS = {"this"}
+import jack_ast
+
 INFIX_OPS = {
     "+": "add",
     "-": "sub",
@@ -26,9 +25,6 @@ KEYWORD_CONSTANTS = {
 }
 
 
-class JackSyntaxError(Exception):
-    """An exception raised when the compiler hits an unexpected case."""
-
 Symbol = collections.namedtuple("Symbol", "name, type, kind, section, index")
 
 class SymbolTable():
@@ -78,6 +74,18 @@ class SymbolTable():
         return self.counts[kind]
 
 
+class LabelAllocator():
+    """Numbers the labels of a class in the order they're allocated."""
+    def __init__(self):
+        self.count = 0
+
+    def allocate(self, *names):
+        """Return the names suffixed with the next number."""
+        labels = ["{}_{}".format(name, self.count) for name in names]
+        self.count += 1
+        return labels
+
+
 def push_symbol(symbol):
     return "push {0.section} {0.index}\t// {0.name}".format(symbol)
 
@@ -90,88 +98,54 @@ def write_label(label):
     return "label {}".format(label)
 
 
-def expect(token, value):
-    if token.value != value:
-        raise JackSyntaxError("Expected '{}', got '{}'".format(value, token.value))
+st = None
+labels = None
 
 
-def expect_type(token, typ):
-    if token.type != typ:
-        raise JackSyntaxError("Expected type '{}', got '{}'".format(typ, token.type))
+def dispatch_compile(_classname, tokengen, writer):
+    """Parse a class from tokens and write its VM code."""
+    generate(_classname, jack_ast.parse_class(tokengen), writer)
 
-st = None
 
-# TODO: How are we going to write the code?
-def dispatch_compile(_classname, tokengen, writer):
-    global st, classname
+def generate(_classname, tree, writer):
+    """Write the VM code of a parsed class."""
+    global st, classname, labels
     st = SymbolTable()
+    labels = LabelAllocator()
     classname = _classname
-    token = next(tokengen)
-    typ, value = token
-    if typ == "keyword" and value == "class":
-        s = compile_class(token, tokengen)
-    else:
-        raise JackSyntaxError("Class file must begin with class declaration")
-    writer.write("\n".join(s))
+    writer.write("\n".join(compile_class(tree)))
 
 
-def compile_class(t, tokengen):
-    """
-    'class' className '{' classVarDec* subroutineDec* '}'
-    """
+def compile_class(node):
     s = []
-    # class keyword
-    t = next(tokengen)
-    # className
-    name = t.value
-    t = next(tokengen)
-    # '{' symbol
-    t = next(tokengen)
-
-    # classvars
-    while t.type == "keyword" and t.value in ("static", "field"):
-        build_classvars(t, tokengen)
-        t = next(tokengen)
-
-    # subroutines
-    while t.type == "keyword" and t.value in ("constructor", "function", "method"):
-        s += compile_subroutine(t, tokengen)
-        t = next(tokengen)
-
-    # '}' symbol
-    expect(t, "}")
-
+    for dec in node.class_vars:
+        build_vars(dec)
+    for subroutine in node.subroutines:
+        s += compile_subroutine(subroutine)
     return s
 
 
-def compile_subroutine(t, tokengen):
-    """
-    ('constructor' | 'function' | 'method') ('void' | type) subroutineName '(' parameterList ')'
-    subroutineBody
-    """
+def compile_subroutine(node):
     s = []
-    # constructor, function, or method
-    kind = t.value
-    t = next(tokengen)
-    # type
-    t = next(tokengen)
-    # subroutineName
-    name = t.value
-    t = next(tokengen)
-    # '(' parameterList ')'
-    st.start_subroutine(method=kind == "method")
-    build_parameter_list(t, tokengen)
-    s.append("function {}.{} {{}}".format(classname, name))
+    st.start_subroutine(method=node.kind == "method")
+    for typ, name in node.parameters:
+        st.add_symbol(name, typ, "argument")
+    s.append("function {}.{} {{}}".format(classname, node.name))
     index = len(s) - 1
 
-    t = next(tokengen)
-    # subroutineBody
-    if kind == "method":
-        s += compile_method(t, tokengen)
-    elif kind == "constructor":
-        s += compile_constructor(t, tokengen)
-    else:
-        s += compile_subroutine_body(t, tokengen)
+    if node.kind == "method":
+        # Methods have implied 'this' argument
+        s.append("push argument 0")
+        s.append("pop pointer 0")
+    elif node.kind == "constructor":
+        # Constructors have implied call to Memory.alloc
+        s.append("push constant {}".format(st.varcount("field")))
+        s.append("call Memory.alloc 1")
+        s.append("pop pointer 0")
+
+    for dec in node.locals:
+        build_vars(dec)
+    s += compile_statements(node.statements)
 
     # Yuck: Since we don't know the number of locals until we compile the
     # subroutine, we go back and adjust the function declaration
@@ -180,532 +154,204 @@ def compile_subroutine(t, tokengen):
     return s
 
 
-def compile_method(t, tokengen):
-    s = []
-    # Methods have implied 'this' argument
-    s.append("push argument 0")
-    s.append("pop pointer 0")
-    # Constructors always end in "return this" so rv is handled
-    s += compile_subroutine_body(t, tokengen)
-    return s
-
-
-def compile_constructor(t, tokengen):
-    s = []
-    # Constructors have implied call to Memory.alloc
-    size = st.varcount("field")
-    s.append("push constant {}".format(size))
-    s.append("call Memory.alloc 1")
-    s.append("pop pointer 0")
-    s += compile_subroutine_body(t, tokengen)
-    return s
-
-
-def compile_subroutine_body(t, tokengen):
+def build_vars(node):
     """
-    '{' varDec* statements '}'
-    """
-    s = []
-    # '{'
-    expect(t, "{")
-
-    # Add all declarations to the symbol table
-    t = next(tokengen)
-    while t.value == "var":
-        build_vars(t, tokengen)
-        t = next(tokengen)
-
-    s += compile_statements(t, tokengen)
-    t = next(tokengen)
-    expect(t, "}")
-    return s
-
-
-def build_classvars(t, tokengen):
-    return build_vars(t, tokengen)
-
-
-def build_vars(t, tokengen):
-    """
-    Normal:
-    'var' type varName (',', varName)* ';'
-    Class:
-    ('static' | 'field') type varName (',' varName)* ';'
-    This function only modifies the symbol table, it does not generate code.
-    """
-    # var, static, or field
-    kind = t.value
-    t = next(tokengen)
-    # type
-    type = t.value
-    t = next(tokengen)
-    # varName
-    st.add_symbol(t.value, type, kind)
-    t = next(tokengen)
-    while t.value == ",":
-        # comma symbol
-        t = next(tokengen)
-        # varName
-        st.add_symbol(t.value, type, kind)
-        t = next(tokengen)
-
-
-def build_parameter_list(t, tokengen):
-    """
-    ((type varName)(',' type varName)*)?
+    Add a 'var', 'static' or 'field' declaration to the symbol table.
     This function only modifies the symbol table, it does not generate code.
-    Return the number of parameters.
-    """
-    num = 0
-    # We include the surrounding parens
-    # '('
-    t = next(tokengen)
-    # parameterList
-    while t.value in TYPES or t.type == "identifier":
-        # type
-        typ = t.value
-        t = next(tokengen)
-        # varName
-        st.add_symbol(t.value, typ, "argument")
-        num += 1
-        t = next(tokengen)
-
-        while t.value == ",":
-            # comma
-            t = next(tokengen)
-            # type
-            typ = t.value
-            t = next(tokengen)
-            # varName
-            st.add_symbol(t.value, typ, "argument")
-            num += 1
-            t = next(tokengen)
-    # ')'
-    expect(t, ")")
-    return num
-
-
-def compile_do(t, tokengen):
-    """
-    'do' subroutineCall ';'
-         subroutineName '(' expressionList ')' | (className | varName) '.' subroutineName '(' expressionList ')'
     """
-    s = []
-    numargs = 0
-    # do keyword
-    expect(t, "do")
-    t = next(tokengen)
-    name = t.value
-    # Either a subroutineName directly or an object or varName followed by a dot and a subroutine name
-    # Either way, it's first an identifier
-    # -- subroutineName OR className | varName
-    t = next(tokengen)
-    if t.value == ".":  # Function or method call on object
-        # -- '.' symbol
-        expect(t, ".")
-        t = next(tokengen)
-        # subroutineName
-        try:
-            # If the identifier is a symbol, get its type to namespace the
-            # call and its name to push as 'this'
-            symbol = st.get(name)
-            name = symbol.type + "." + t.value
-            s.append(push_symbol(symbol))
-            numargs += 1
-        except:
-            # Otherwise, must be a class function call, no extra args
-            name = name + "." + t.value
-        t = next(tokengen)
-    else:  # If the object or class isn't specified, it's a 'thismethod'
-        s.append("push pointer 0")
-        numargs += 1
-        name = classname + "." + name
+    for name in node.names:
+        st.add_symbol(name, node.type, node.kind)
 
-    # '(' symbol
-    expect(t, "(")
-    t = next(tokengen)
 
-    # expressionList
-    args, n = compile_expression_list(t, tokengen)
-    s += args
-    numargs += n
-    t = next(tokengen)
-
-    # ')' symbol
-    expect(t, ")")
-    t = next(tokengen)
+def compile_statements(statements):
+    s = []
+    for statement in statements:
+        s += STATEMENT_TYPES[type(statement)](statement)
+    return s
 
-    # ';' symbol
-    expect(t, ";")
 
-    s.append("call {} {}".format(name, numargs))
+def compile_do(node):
+    s = compile_call(node.call)
     # Throw away the return value
     s.append("pop temp 0")
-
     return s
 
 
-def compile_let(t, tokengen):
-    """
-    'let' varName( '[' expression ']' )? '=' expression ';'
-    """
+def compile_let(node):
     s = []
-    # let keyword
-    expect(t, "let")
-    # varName
-    t = next(tokengen)
-    name = t.value
-    symbol = st.get(name)
-
-    poptarget = []
-
-    t = next(tokengen)
-    # Array access
-    if t.value == "[":
-        # '[' symbol
-        t = next(tokengen)
-        # single expression (offset into array)
-        s += compile_expression(t, tokengen)
-        # push symbol
-        s.append(push_symbol(symbol))
-        # add the offset
-        s.append("add")
-        # can't pop it into `that` yet: there might be other array access that'll trash `that`.
-        t = next(tokengen)
-        # ']' symbol
-        expect(t, "]")
-        t = next(tokengen)
-        poptarget.append("pop temp 0\t// pop expression to assign")
-        poptarget.append("pop pointer 1\t// pop target pointer into that")
-        poptarget.append("push temp 0\t// push expression back")
-        poptarget.append("pop that 0\t// pop into that[0]")
-    else:
-        poptarget.append(pop_symbol(symbol))
-    # '='
-    expect(t, "=")
-    t = next(tokengen)
-    # single expression
-    s += compile_expression(t, tokengen)
-    t = next(tokengen)
-    # ';'
-    expect(t, ";")
-    s += poptarget
-
+    symbol = st.get(node.name)
+    if node.index is None:
+        s += compile_expression(node.value)
+        s.append(pop_symbol(symbol))
+        return s
 
+    # Array access: offset into array plus its base
+    s += compile_expression(node.index)
+    s.append(push_symbol(symbol))
+    s.append("add")
+    # can't pop it into `that` yet: there might be other array access that'll trash `that`.
+    s += compile_expression(node.value)
+    s.append("pop temp 0\t// pop expression to assign")
+    s.append("pop pointer 1\t// pop target pointer into that")
+    s.append("push temp 0\t// push expression back")
+    s.append("pop that 0\t// pop into that[0]")
     return s
 
 
-def compile_while(t, tokengen):
-    """
-    'while' '(' expression ')' '{' statements '}'
-    """
-    top_label = "WHILE_TOP_{}".format(tokengen.count)
-    end_label = "WHILE_END_{}".format(tokengen.count)
+def compile_while(node):
+    top_label, end_label = labels.allocate("WHILE_TOP", "WHILE_END")
     s = []
-    # while keyword
-    expect(t, "while")
-    t = next(tokengen)
-    # '(' symbol
-    t = next(tokengen)
     s.append(write_label(top_label))
-    # single expression
-    s += compile_expression(t, tokengen)
-    t = next(tokengen)
-    # ')' symbol
+    s += compile_expression(node.condition)
     # Negate the expression since we jump if it ISN'T true
     s.append("not")
     s.append("if-goto {}".format(end_label))
-    t = next(tokengen)
-    # '{' symbol
-    expect(t, "{")
-    t = next(tokengen)
-    # statements
-    s += compile_statements(t, tokengen)
-    t = next(tokengen)
-    # '}' symbol
-    expect(t, "}")
+    s += compile_statements(node.body)
     s.append("goto {}".format(top_label))
     s.append(write_label(end_label))
-
     return s
 
 
-def compile_return(t, tokengen):
-    """
-    'return' expression? ';'
-    """
+def compile_return(node):
     s = []
-    # return keyword
-    t = next(tokengen)
-
-    # optional expression
-    if t.value != ";":
-        s += compile_expression(t, tokengen)
-        t = next(tokengen)
+    if node.value is not None:
+        s += compile_expression(node.value)
     else:
         s.append("push constant 0")
-    # Semicolon already removed
-    expect(t, ";")
-
     s.append("return")
-
     return s
 
 
-def compile_if(t, tokengen):
-    """
-    'if' '(' expression ')' '{' statements '}'
-    ('else' '{' statements '}')?
-    """
-    else_label = "IF_ELSE_{}".format(tokengen.count)
-    end_label = "IF_END_{}".format(tokengen.count)
+def compile_if(node):
+    else_label, end_label = labels.allocate("IF_ELSE", "IF_END")
     s = []
-    # if keyword
-    expect(t, "if")
-    t = next(tokengen)
-    # '(' symbol
-    expect(t, "(")
-    t = next(tokengen)
-    # single expression
-    s += compile_expression(t, tokengen)
-    t = next(tokengen)
-    # ')' symbol
-    expect(t, ")")
+    s += compile_expression(node.condition)
     # Negate the expression since we jump if it ISN'T true
     s.append("not")
     s.append("if-goto {}".format(else_label))
-    t = next(tokengen)
-    # '{' symbol
-    expect(t, "{")
-    t = next(tokengen)
-    # statements
-    s += compile_statements(t, tokengen)
-    t = next(tokengen)
-    # '}' symbol
-    expect(t, "}")
+    s += compile_statements(node.then)
 
     # If there's no else, then we're done
-    tp = tokengen.peek()
-    if tp.value != "else":
+    if node.otherwise is None:
         s.append(write_label(else_label))
         return s
 
     # Done the if block, jump over the else
     s.append("goto {}".format(end_label))
     s.append(write_label(else_label))
-
-    t = next(tokengen)
-    # else keyword
-    expect(t, "else")
-    t = next(tokengen)
-    # '{' symbol
-    expect(t, "{")
-    t = next(tokengen)
-    # statements
-    s += compile_statements(t, tokengen)
-    t = next(tokengen)
-    # '}' symbol
-    expect(t, "}")
+    s += compile_statements(node.otherwise)
     s.append(write_label(end_label))
-
     return s
 
 
 STATEMENT_TYPES = {
-    "let": compile_let,
-    "if": compile_if,
-    "while": compile_while,
-    "do": compile_do,
-    "return": compile_return,
+    jack_ast.Let: compile_let,
+    jack_ast.If: compile_if,
+    jack_ast.While: compile_while,
+    jack_ast.Do: compile_do,
+    jack_ast.Return: compile_return,
 }
 
 
-def compile_statements(t, tokengen):
+def compile_call(node):
+    """
+    subroutineName '(' expressionList ')' |
+    (className | varName) '.' subroutineName '(' expressionList ')'
+    """
     s = []
-    while t.value != '}': # TODO: Better test?
-        s += compile_statement(t, tokengen)
-        t = next(tokengen)
+    numargs = len(node.args)
+    if node.receiver is None:
+        # If the object or class isn't specified, it's a 'thismethod'
+        s.append("push pointer 0")
+        numargs += 1
+        name = classname + "." + node.name
+    else:
+        try:
+            # If the receiver is a symbol, get its type to namespace the
+            # call and push it as 'this'
+            symbol = st.get(node.receiver)
+            name = symbol.type + "." + node.name
+            s.append(push_symbol(symbol))
+            numargs += 1
+        except Exception:
+            # Otherwise, must be a function or constructor call
+            name = node.receiver + "." + node.name
 
-    tokengen.pushback(t)
+    for arg in node.args:
+        s += compile_expression(arg)
+    s.append("call {} {}".format(name, numargs))
     return s
 
-def compile_statement(t, tokengen):
-    return STATEMENT_TYPES[t.value](t, tokengen)
 
+def compile_integer_constant(node):
+    return ["push constant {}".format(node.value)]
 
-def compile_term(t, tokengen):
-    """
-    integerConstant | stringConstant | keywordConstant |
-    varName | varName '[' expression ']' | subroutineCall |
-    '(' expression ')' | unaryOp term
-    This has to do a look ahead to distinguish between:
-    varName
-    varName '[' expression ']'
-    subroutine call:
-      subroutineName '(' expressionList ')' |
-      (className | varName) '.' subroutineName '(' expressionList ')'
-    """
+
+def compile_string_constant(node):
     s = []
+    s.append("push constant {}\t// Creating string \"{}\"".format(len(node.value), node.value))
+    s.append("call String.new 1")
+    for c in node.value:
+        s.append("push constant {}".format(ord(c)))
+        s.append("call String.appendChar 2")
+    return s
 
-    if t.type == "integerConstant":
-        # type = number
-        # TODO: How to do get string address?
-        s.append("push constant {}".format(t.value))
-    elif t.type == "stringConstant":
-        l = len(t.value)
-        s.append("push constant {}\t// Creating string \"{}\"".format(l, t.value))
-        s.append("call String.new 1")
-        for c in t.value:
-            s.append("push constant {}".format(ord(c)))
-            s.append("call String.appendChar 2")
-    elif t.value in KEYWORD_CONSTANTS:
-        # type = number
-        # TODO: How do we handle 'this'?
-        s.append("push {}".format(KEYWORD_CONSTANTS[t.value]))
-    elif t.value in UNARY_OPS:
-        # type = unary
-        op = t.value
-        t = next(tokengen)
-        s += compile_term(t, tokengen)
-        s.append(UNARY_OPS[op])
-    elif t.value == "(":
-        # '(' symbol
-        t = next(tokengen)
-
-        # expression
-        s += compile_expression(t, tokengen)
-        t = next(tokengen)
-
-        # ')' symbol
-        expect(t, ")")
-    else:  # an identifier, with either possibly a call or indexing
-        # TODO: Pull these from the symbol table that was built in the class and method declaration
-        expect_type(t, "identifier")
-        name = t.value
-        tp = tokengen.peek()
-        if tp.value == ".":  # Method/class function call
-            numargs = 0
-            try:
-                # If the identifier is a symbol, get its type to namespace the
-                # call and its name to push 'this'
-                symbol = st.get(name)
-                name = symbol.type
-                s.append(push_symbol(symbol))
-                numargs += 1
-            except:
-                # Otherwise, must be a function or constructor call
-                pass
-            t = next(tokengen)
-            # -- '.' symbol
-            expect(t, ".")
-            t = next(tokengen)
-            # subroutineName
-            name = name + "." + t.value
-            t = next(tokengen)
-
-            # '(' symbol
-            expect(t, "(")
-            t = next(tokengen)
-
-            # expressionList
-            args, n = compile_expression_list(t, tokengen)
-            s += args
-            numargs += n
-            t = next(tokengen)
-
-            # ')' symbol
-            expect(t, ")")
-
-            # Now with the args set up call the method
-            s.append("call {} {}".format(name, numargs))
-        elif tp.value == "[":  # Array access
-            t = next(tokengen)
-            # '[' symbol
-            expect(t, "[")
-            t = next(tokengen)
-
-            # expression for index
-            s += compile_expression(t, tokengen)
-            symbol = st.get(name)
-            s.append(push_symbol(symbol))
-            # add array base to index
-            s.append("add")
-            # pop into that
-            s.append("pop pointer 1")
-            # push value at that[0]
-            s.append("push that 0")
-            t = next(tokengen)
-
-            # ']' symbol
-            expect(t, "]")
-        elif tp.value == "(":  # This method call
-            # Push 'this'
-            s.append("push pointer 0")
-            numargs = 1
-            t = next(tokengen)
-            # '(' symbol
-            expect(t, "(")
-            t = next(tokengen)
-
-            # expressionList
-            args, n = compile_expression_list(t, tokengen)
-            s += args
-            numargs += n
-            t = next(tokengen)
-
-            # ')' symbol
-            expect(t, ")")
-
-            # Now with args set up call the function
-            s.append("call {} {}".format(name, numargs))
-        else:  # Just a reference
-            # In this case we DON'T pop the peeked token
-            # TODO: Find section and index
-            symbol = st.get(name)
-            s.append(push_symbol(symbol))
-            pass
 
+def compile_keyword_constant(node):
+    return ["push {}".format(KEYWORD_CONSTANTS[node.value])]
+
+
+def compile_var_ref(node):
+    return [push_symbol(st.get(node.name))]
+
+
+def compile_array_ref(node):
+    s = compile_expression(node.index)
+    s.append(push_symbol(st.get(node.name)))
+    # add array base to index
+    s.append("add")
+    # pop into that
+    s.append("pop pointer 1")
+    # push value at that[0]
+    s.append("push that 0")
     return s
 
 
-def compile_expression_list(t, tokengen):
-    """
-    (expression (',' expression)*)?
-    """
-    s = []
-    n = 0
-    while t.value != ")":
-        s += compile_expression(t, tokengen)
-        n += 1
-        t = next(tokengen)
-        while t.value == ",":
-            t = next(tokengen)
-            s += compile_expression(t, tokengen)
-            n += 1
-            t = next(tokengen)
-
-    tokengen.pushback(t)
-    return s, n
-
-def compile_expression(t, tokengen):
+def compile_unary(node):
+    s = compile_term(node.term)
+    s.append(UNARY_OPS[node.op])
+    return s
+
+
+def compile_parenthesized(node):
+    return compile_expression(node.expression)
+
+
+TERM_TYPES = {
+    jack_ast.IntegerConstant: compile_integer_constant,
+    jack_ast.StringConstant: compile_string_constant,
+    jack_ast.KeywordConstant: compile_keyword_constant,
+    jack_ast.VarRef: compile_var_ref,
+    jack_ast.ArrayRef: compile_array_ref,
+    jack_ast.Call: compile_call,
+    jack_ast.Unary: compile_unary,
+    jack_ast.Parenthesized: compile_parenthesized,
+}
+
+
+def compile_term(node):
+    return TERM_TYPES[type(node)](node)
+
+
+def compile_expression(node):
     """
     term (op term)*
+    Operators group to the right: every term is pushed, then the
+    operators are applied from the last one back.
     """
-
     s = []
-    # term
-    s += compile_term(t, tokengen)
-    t = tokengen.peek()
-    if t.value in INFIX_OPS:
-        # Remove peeked value
-        next(tokengen)
-        op = INFIX_OPS[t.value]
-        t = next(tokengen)
-        # term
-        # TODO: Should we consider this next term a new expression (and not need the loop?)
-        s += compile_expression(t, tokengen)
-        t = tokengen.peek()
-        # Emit op last
-        s.append(op)
-
+    for term in node.terms:
+        s += compile_term(term)
+    for op in reversed(node.ops):
+        s.append(INFIX_OPS[op])
     return s
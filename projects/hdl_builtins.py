@@ -0,0 +1,275 @@
+"""Python implementations of the builtin chips in tools/builtInChips.
+
+Pins are lists of bit values, least significant bit first. Combinational
+chips are functions taking the mask M, a value with every bit set, and
+their input pins in declaration order, and returning their output pins.
+Bits are computed with bitwise operators only, so a bit value may hold
+any number of independent bits under M.
+
+Chips with state are classes whose instances evaluate their outputs from
+their state and inputs, and update their state on tick. Registers and
+memories can be read and written by index, for test scripts.
+"""
+WORD_WIDTH = 16
+
+
+def to_int(bits):
+    """Return the value of a pin whose bits are 0 or 1."""
+    value = 0
+    for i, bit in enumerate(bits):
+        value |= bit << i
+    return value
+
+
+def to_bits(value, width):
+    return [(value >> i) & 1 for i in range(width)]
+
+
+def mux_bits(a, b, sel, M):
+    keep = ~sel & M
+    return [(x & keep) | (y & sel) for x, y in zip(a, b)]
+
+
+def add_bits(a, b):
+    """Add two buses, dropping the carry out."""
+    out = []
+    carry = 0
+    for x, y in zip(a, b):
+        half = x ^ y
+        out.append(half ^ carry)
+        carry = (x & y) | (carry & half)
+    return out
+
+
+# Combinational chips
+
+def nand(M, a, b):
+    return [~(a[0] & b[0]) & M],
+
+
+def not_(M, in_):
+    return [~in_[0] & M],
+
+
+def and_(M, a, b):
+    return [a[0] & b[0]],
+
+
+def or_(M, a, b):
+    return [a[0] | b[0]],
+
+
+def xor(M, a, b):
+    return [a[0] ^ b[0]],
+
+
+def mux(M, a, b, sel):
+    return mux_bits(a, b, sel[0], M),
+
+
+def dmux(M, in_, sel):
+    return [in_[0] & ~sel[0]], [in_[0] & sel[0]]
+
+
+def not16(M, in_):
+    return [~x & M for x in in_],
+
+
+def and16(M, a, b):
+    return [x & y for x, y in zip(a, b)],
+
+
+def or16(M, a, b):
+    return [x | y for x, y in zip(a, b)],
+
+
+def or8way(M, in_):
+    out = 0
+    for x in in_:
+        out |= x
+    return [out],
+
+
+def mux4way16(M, a, b, c, d, sel):
+    return mux_bits(mux_bits(a, b, sel[0], M), mux_bits(c, d, sel[0], M), sel[1], M),
+
+
+def mux8way16(M, a, b, c, d, e, f, g, h, sel):
+    low, = mux4way16(M, a, b, c, d, sel[:2])
+    high, = mux4way16(M, e, f, g, h, sel[:2])
+    return mux_bits(low, high, sel[2], M),
+
+
+def dmux4way(M, in_, sel):
+    low, high = dmux(M, in_, sel[1:])
+    return dmux(M, low, sel[:1]) + dmux(M, high, sel[:1])
+
+
+def dmux8way(M, in_, sel):
+    low, high = dmux(M, in_, sel[2:])
+    return dmux4way(M, low, sel[:2]) + dmux4way(M, high, sel[:2])
+
+
+def half_adder(M, a, b):
+    return [a[0] ^ b[0]], [a[0] & b[0]]
+
+
+def full_adder(M, a, b, c):
+    half = a[0] ^ b[0]
+    return [half ^ c[0]], [(a[0] & b[0]) | (c[0] & half)]
+
+
+def add16(M, a, b):
+    return add_bits(a, b),
+
+
+def inc16(M, in_):
+    return add_bits(in_, [M] + [0] * (len(in_) - 1)),
+
+
+def alu(M, x, y, zx, nx, zy, ny, f, no):
+    x = [(b & ~zx[0]) ^ nx[0] for b in x]
+    y = [(b & ~zy[0]) ^ ny[0] for b in y]
+    out = mux_bits([a & b for a, b in zip(x, y)], add_bits(x, y), f[0], M)
+    out = [b ^ no[0] for b in out]
+    zr = 0
+    for b in out:
+        zr |= b
+    return out, [~zr & M], [out[-1]]
+
+
+# Chips with state
+
+class DFF():
+    def __init__(self):
+        self.state = 0
+
+    def evaluate(self, M, in_):
+        return [self.state],
+
+    def tick(self, M, in_):
+        self.state = in_[0]
+
+
+class Bit(DFF):
+    def evaluate(self, M, in_, load):
+        return [self.state],
+
+    def tick(self, M, in_, load):
+        self.state = mux_bits([self.state], in_, load[0], M)[0]
+
+
+class Register():
+    def __init__(self):
+        self.bits = [0] * WORD_WIDTH
+
+    def __getitem__(self, index):
+        return to_int(self.bits)
+
+    def __setitem__(self, index, value):
+        self.bits = to_bits(value, WORD_WIDTH)
+
+    def evaluate(self, M, in_, load):
+        return self.bits,
+
+    def tick(self, M, in_, load):
+        self.bits = mux_bits(self.bits, in_, load[0], M)
+
+
+class PC(Register):
+    def evaluate(self, M, in_, load, inc, reset):
+        return self.bits,
+
+    def tick(self, M, in_, load, inc, reset):
+        bits = mux_bits(self.bits, inc16(M, self.bits)[0], inc[0], M)
+        bits = mux_bits(bits, in_, load[0], M)
+        self.bits = mux_bits(bits, [0] * WORD_WIDTH, reset[0], M)
+
+
+class ROM():
+    """A memory addressed by an input pin. Only works with single bits."""
+    size = 0x8000
+
+    def __init__(self):
+        self.words = [0] * self.size
+
+    def __getitem__(self, index):
+        return self.words[index]
+
+    def __setitem__(self, index, value):
+        self.words[index] = value & 0xFFFF
+
+    def load(self, words):
+        self.words[:len(words)] = words
+
+    def evaluate(self, M, address):
+        return to_bits(self.words[to_int(address)], WORD_WIDTH),
+
+
+class RAM(ROM):
+    """A memory written on tick. Only works with single bits."""
+    def evaluate(self, M, in_, load, address):
+        return to_bits(self.words[to_int(address)], WORD_WIDTH),
+
+    def tick(self, M, in_, load, address):
+        if load[0]:
+            self.words[to_int(address)] = to_int(in_)
+
+
+def ram(size):
+    return type("RAM{}".format(size), (RAM,), {"size": size})
+
+
+class Keyboard():
+    def __init__(self):
+        self.key = 0
+
+    def __getitem__(self, index):
+        return self.key
+
+    def __setitem__(self, index, value):
+        self.key = value & 0xFFFF
+
+    def evaluate(self, M):
+        return to_bits(self.key, WORD_WIDTH),
+
+
+COMBINATIONAL = {
+    "Nand": nand,
+    "Not": not_,
+    "And": and_,
+    "Or": or_,
+    "Xor": xor,
+    "Mux": mux,
+    "DMux": dmux,
+    "Not16": not16,
+    "And16": and16,
+    "Or16": or16,
+    "Or8Way": or8way,
+    "Mux16": mux,
+    "Mux4Way16": mux4way16,
+    "Mux8Way16": mux8way16,
+    "DMux4Way": dmux4way,
+    "DMux8Way": dmux8way,
+    "HalfAdder": half_adder,
+    "FullAdder": full_adder,
+    "Add16": add16,
+    "Inc16": inc16,
+    "ALU": alu,
+}
+STATEFUL = {
+    "DFF": DFF,
+    "Bit": Bit,
+    "Register": Register,
+    "ARegister": Register,
+    "DRegister": Register,
+    "PC": PC,
+    "RAM8": ram(8),
+    "RAM64": ram(64),
+    "RAM512": ram(512),
+    "RAM4K": ram(4096),
+    "RAM16K": ram(16384),
+    "ROM32K": ROM,
+    "Screen": ram(8192),
+    "Keyboard": Keyboard,
+}
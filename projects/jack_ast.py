@@ -0,0 +1,364 @@
+"""The syntax tree of a Jack class, and the parser building it from tokens.
+
+The tree keeps everything the analyzer's XML shows, down to parenthesized
+expressions, so the compiler and the analyzer are both backends over it.
+The parser reads a tokenizer.TokenCursor through its value and type
+methods, so no Token is built while parsing.
+"""
+TYPES = {"int", "char", "boolean", "void"}
+INFIX_OPS = {"+", "-", "*", "/", "&", "|", "<", ">", "="}
+UNARY_OPS = {"-", "~"}
+KEYWORD_CONSTANTS = {"true", "false", "null", "this"}
+CLASS_VAR_KINDS = {"static", "field"}
+SUBROUTINE_KINDS = {"constructor", "function", "method"}
+
+
+class JackSyntaxError(Exception):
+    """An exception raised when the compiler hits an unexpected case."""
+
+
+class Node():
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            repr(getattr(self, name)) for name in self.__slots__))
+
+
+class Class(Node):
+    __slots__ = ("name", "class_vars", "subroutines")
+
+
+class VarDec(Node):
+    """A 'static', 'field' or 'var' declaration of one or more names."""
+    __slots__ = ("kind", "type", "names")
+
+
+class Subroutine(Node):
+    """parameters is a list of (type, name)."""
+    __slots__ = ("kind", "return_type", "name", "parameters", "locals", "statements")
+
+
+class Let(Node):
+    """index is None unless an array element is assigned."""
+    __slots__ = ("name", "index", "value")
+
+
+class If(Node):
+    """otherwise is None without an else."""
+    __slots__ = ("condition", "then", "otherwise")
+
+
+class While(Node):
+    __slots__ = ("condition", "body")
+
+
+class Do(Node):
+    __slots__ = ("call",)
+
+
+class Return(Node):
+    """value is None for a bare return."""
+    __slots__ = ("value",)
+
+
+class Expression(Node):
+    """terms[0] ops[0] terms[1] ops[1] ..."""
+    __slots__ = ("terms", "ops")
+
+
+class IntegerConstant(Node):
+    __slots__ = ("value",)
+
+
+class StringConstant(Node):
+    __slots__ = ("value",)
+
+
+class KeywordConstant(Node):
+    __slots__ = ("value",)
+
+
+class VarRef(Node):
+    __slots__ = ("name",)
+
+
+class ArrayRef(Node):
+    __slots__ = ("name", "index")
+
+
+class Call(Node):
+    """receiver is the class or variable before the '.', or None."""
+    __slots__ = ("receiver", "name", "args")
+
+
+class Unary(Node):
+    __slots__ = ("op", "term")
+
+
+class Parenthesized(Node):
+    __slots__ = ("expression",)
+
+
+def expect(tokengen, value):
+    """Consume the next token, which must be value."""
+    t = tokengen.next_value()
+    if t != value:
+        raise syntax_error(tokengen, "Expected '{}', got '{}'".format(value, t))
+    return t
+
+
+def syntax_error(tokengen, message):
+    if hasattr(tokengen, "position"):
+        message = "line {}, column {}: {}".format(*tokengen.position(), message)
+    return JackSyntaxError(message)
+
+
+def parse_class(tokengen):
+    """
+    'class' className '{' classVarDec* subroutineDec* '}'
+    """
+    typ = tokengen.peek_type()
+    if tokengen.next_value() != "class" or typ != "keyword":
+        raise syntax_error(tokengen, "Class file must begin with class declaration")
+    name = tokengen.next_value()
+    expect(tokengen, "{")
+
+    class_vars = []
+    while tokengen.peek_value() in CLASS_VAR_KINDS:
+        class_vars.append(parse_var_dec(tokengen))
+
+    subroutines = []
+    while tokengen.peek_value() in SUBROUTINE_KINDS:
+        subroutines.append(parse_subroutine(tokengen))
+
+    expect(tokengen, "}")
+    return Class(name, class_vars, subroutines)
+
+
+def parse_var_dec(tokengen):
+    """
+    ('static' | 'field' | 'var') type varName (',' varName)* ';'
+    """
+    kind = tokengen.next_value()
+    typ = tokengen.next_value()
+    names = [tokengen.next_value()]
+    while tokengen.peek_value() == ",":
+        tokengen.next_value()
+        names.append(tokengen.next_value())
+    expect(tokengen, ";")
+    return VarDec(kind, typ, names)
+
+
+def parse_subroutine(tokengen):
+    """
+    ('constructor' | 'function' | 'method') ('void' | type) subroutineName
+    '(' parameterList ')' '{' varDec* statements '}'
+    """
+    kind = tokengen.next_value()
+    return_type = tokengen.next_value()
+    name = tokengen.next_value()
+
+    # parameterList: ((type varName) (',' type varName)*)?
+    expect(tokengen, "(")
+    parameters = []
+    while tokengen.peek_value() in TYPES or tokengen.peek_type() == "identifier":
+        typ = tokengen.next_value()
+        parameters.append((typ, tokengen.next_value()))
+        if tokengen.peek_value() != ",":
+            break
+        tokengen.next_value()
+    expect(tokengen, ")")
+
+    expect(tokengen, "{")
+    local_vars = []
+    while tokengen.peek_value() == "var":
+        local_vars.append(parse_var_dec(tokengen))
+    statements = parse_statements(tokengen)
+    expect(tokengen, "}")
+    return Subroutine(kind, return_type, name, parameters, local_vars, statements)
+
+
+def parse_statements(tokengen):
+    """Parse statements up to a '}', which is left for the caller."""
+    statements = []
+    t = tokengen.peek_value()
+    while t != "}":
+        if t not in STATEMENT_TYPES:
+            tokengen.next_value()
+            raise syntax_error(tokengen, "Expected a statement, got '{}'".format(t))
+        statements.append(STATEMENT_TYPES[t](tokengen))
+        t = tokengen.peek_value()
+    return statements
+
+
+def parse_block(tokengen):
+    """
+    '{' statements '}'
+    """
+    expect(tokengen, "{")
+    statements = parse_statements(tokengen)
+    expect(tokengen, "}")
+    return statements
+
+
+def parse_condition(tokengen):
+    """
+    '(' expression ')'
+    """
+    expect(tokengen, "(")
+    condition = parse_expression(tokengen)
+    expect(tokengen, ")")
+    return condition
+
+
+def parse_let(tokengen):
+    """
+    'let' varName ('[' expression ']')? '=' expression ';'
+    """
+    expect(tokengen, "let")
+    name = tokengen.next_value()
+    index = None
+    if tokengen.peek_value() == "[":
+        tokengen.next_value()
+        index = parse_expression(tokengen)
+        expect(tokengen, "]")
+    expect(tokengen, "=")
+    value = parse_expression(tokengen)
+    expect(tokengen, ";")
+    return Let(name, index, value)
+
+
+def parse_if(tokengen):
+    """
+    'if' '(' expression ')' '{' statements '}' ('else' '{' statements '}')?
+    """
+    expect(tokengen, "if")
+    condition = parse_condition(tokengen)
+    then = parse_block(tokengen)
+    otherwise = None
+    if tokengen.peek_value() == "else":
+        tokengen.next_value()
+        otherwise = parse_block(tokengen)
+    return If(condition, then, otherwise)
+
+
+def parse_while(tokengen):
+    """
+    'while' '(' expression ')' '{' statements '}'
+    """
+    expect(tokengen, "while")
+    condition = parse_condition(tokengen)
+    return While(condition, parse_block(tokengen))
+
+
+def parse_do(tokengen):
+    """
+    'do' subroutineCall ';'
+    """
+    expect(tokengen, "do")
+    name = tokengen.next_value()
+    call = parse_call(tokengen, name)
+    expect(tokengen, ";")
+    return Do(call)
+
+
+def parse_return(tokengen):
+    """
+    'return' expression? ';'
+    """
+    expect(tokengen, "return")
+    value = None
+    if tokengen.peek_value() != ";":
+        value = parse_expression(tokengen)
+    expect(tokengen, ";")
+    return Return(value)
+
+
+STATEMENT_TYPES = {
+    "let": parse_let,
+    "if": parse_if,
+    "while": parse_while,
+    "do": parse_do,
+    "return": parse_return,
+}
+
+
+def parse_call(tokengen, name):
+    """Parse the rest of a subroutine call whose first identifier was name:
+    ('.' subroutineName)? '(' expressionList ')'
+    """
+    receiver = None
+    if tokengen.peek_value() == ".":
+        tokengen.next_value()
+        receiver, name = name, tokengen.next_value()
+    expect(tokengen, "(")
+    args = parse_expression_list(tokengen)
+    expect(tokengen, ")")
+    return Call(receiver, name, args)
+
+
+def parse_expression_list(tokengen):
+    """
+    (expression (',' expression)*)?
+    """
+    args = []
+    if tokengen.peek_value() == ")":
+        return args
+    args.append(parse_expression(tokengen))
+    while tokengen.peek_value() == ",":
+        tokengen.next_value()
+        args.append(parse_expression(tokengen))
+    return args
+
+
+def parse_expression(tokengen):
+    """
+    term (op term)*
+    """
+    terms = [parse_term(tokengen)]
+    ops = []
+    while tokengen.peek_value() in INFIX_OPS:
+        ops.append(tokengen.next_value())
+        terms.append(parse_term(tokengen))
+    return Expression(terms, ops)
+
+
+def parse_term(tokengen):
+    """
+    integerConstant | stringConstant | keywordConstant |
+    varName | varName '[' expression ']' | subroutineCall |
+    '(' expression ')' | unaryOp term
+    Looks a token ahead after an identifier to tell a variable, an array
+    element and a call apart.
+    """
+    typ = tokengen.peek_type()
+    t = tokengen.next_value()
+    if typ == "integerConstant":
+        return IntegerConstant(t)
+    if typ == "stringConstant":
+        return StringConstant(t)
+    if t in KEYWORD_CONSTANTS:
+        return KeywordConstant(t)
+    if t in UNARY_OPS:
+        return Unary(t, parse_term(tokengen))
+    if t == "(":
+        expression = parse_expression(tokengen)
+        expect(tokengen, ")")
+        return Parenthesized(expression)
+
+    if typ != "identifier":
+        raise syntax_error(tokengen, "Expected type 'identifier', got '{}'".format(typ))
+    following = tokengen.peek_value()
+    if following in (".", "("):
+        return parse_call(tokengen, t)
+    if following == "[":
+        tokengen.next_value()
+        index = parse_expression(tokengen)
+        expect(tokengen, "]")
+        return ArrayRef(t, index)
+    return VarRef(t)